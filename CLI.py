@@ -1,15 +1,35 @@
-import markov
-import json
-import numpy as np
+import argparse
+import atexit
+import sys
+import registry
 from termcolor import colored
 
-def make_predictions(state, params, markov_model, generic_model, num_days):   
+# numpy and the modules that need it (markov, cache, batch) take several
+# times longer to import than the rest of the program, so they are only
+# imported once a model is needed: the menus show up at once.
+
+# the pre-built models, listed from the manifest in their directory
+model_registry = registry.ModelRegistry()
+
+# models trained in this and earlier runs, so that training again with
+# the same parameters on unchanged data is instant
+_model_cache = None
+
+def get_model_cache():
+    global _model_cache
+    if _model_cache is None:
+        import cache
+        _model_cache = cache.ModelCache(directory="data/model_cache")
+    return _model_cache
+
+def make_predictions(state, model, num_days):   
+    import numpy as np
+    import markov
     print(colored("\nPREDICTIONS\n", "cyan", attrs=["bold"]), end="")
 
-    all_possibilities = markov.construct_states_vector_template(params)
-    generic_vector = markov.construct_generic_probability_vector(generic_model, all_possibilities)
-    transition_matrix = markov.construct_transition_matrix(markov_model, all_possibilities, generic_vector)
-    state_prob_vector = markov.construct_state_probability_vector(markov_model, all_possibilities, state, generic_vector)
+    # each step of an n-gram model forecasts its next n_gram days
+    n_gram = model.n_gram
+    predictions = model.forecast([state], -(-num_days // n_gram))[0]
 
     prediction_keywords = {
         "18 < tavg <= 25": "Moderate average temperature",
@@ -30,9 +50,14 @@ def make_predictions(state, params, markov_model, generic_model, num_days):
     }
 
     
-    for i in range(num_days):
-        print(colored(f"\nOn Day {i+1}: \n", "white", attrs=["bold"]), end="")
-        indices = sorted(range(len(state_prob_vector)), key=lambda i: state_prob_vector[i], reverse=True)[:10]
+    for step, state_prob_vector in enumerate(predictions):
+        first_day = step * n_gram + 1
+        last_day = first_day + n_gram - 1
+        if first_day == last_day:
+            print(colored(f"\nOn Day {first_day}: \n", "white", attrs=["bold"]), end="")
+        else:
+            print(colored(f"\nOn Days {first_day} to {last_day}: \n", "white", attrs=["bold"]), end="")
+        indices = np.argsort(-state_prob_vector, kind="stable")[:10]
         for index in indices:
             prob = state_prob_vector[index]*100
             if prob < 0.5: continue
@@ -40,17 +65,21 @@ def make_predictions(state, params, markov_model, generic_model, num_days):
             print(colored(f"{prob}%", "white", attrs=["bold"]), end="")
             print(" chance of:")
 
-            info = all_possibilities[index]
+            info = markov.decode_state(index, model.params, n_gram)
             info_bits = info[:-2].split("; ")
 
-            for i in range(len(info_bits) - 1):
-                print(f"   * {prediction_keywords[info_bits[i]]} ({info_bits[i]}), with")
-            print(f"   * {prediction_keywords[info_bits[len(info_bits) - 1]]} ({info_bits[len(info_bits) - 1]})")
+            # one group of bits per day, oldest first
+            for day in range(last_day - first_day + 1):
+                day_bits = info_bits[day * len(model.params):(day + 1) * len(model.params)]
+                if first_day != last_day:
+                    print(f"   Day {first_day + day}:")
+                for i in range(len(day_bits) - 1):
+                    print(f"   * {prediction_keywords[day_bits[i]]} ({day_bits[i]}), with")
+                print(f"   * {prediction_keywords[day_bits[len(day_bits) - 1]]} ({day_bits[len(day_bits) - 1]})")
             # print(f"     {info}")
         print("--- and some more possibilities of lower likelihoods")
-        state_prob_vector = np.dot(transition_matrix, state_prob_vector)
 
-    options_after_prediction(markov_model, params)
+    options_after_prediction(model)
 
 def print_warning():
     warning = """
@@ -109,7 +138,9 @@ number of parameters used to train a model? [y/n]"""
         while not (selection.lower() == "y"):
             selection = input(f"Please enter a valid choice. [y] ").strip()
 
-def setup_predictions(params, markov_model):
+def setup_predictions(model):
+    import markov
+    params = model.params
     keywords = {
         "tavg" : "avg temp today in °C",
         "tmax" : "max temp today in °C",
@@ -155,32 +186,47 @@ def setup_predictions(params, markov_model):
 
     print(colored("\nMAKING FORECASTS\n", "cyan", attrs=["bold"]))
 
-    print("To predict the weather in the future, we will start by describing today's weather.")
-
-    for param in params:
-        print(colored(f"\n{param}) ", "white", attrs=["bold"]), end="")
-        print(f"Select a range for {keywords[param]} ({param}): \n")
-        i = 1
-        for value_range in param_ranges[param]:
-            print(f"[{i}] {value_range}\n")
-            i += 1
-        selection = input(f"Choose an option (enter {','.join([str(j) for j in range(1, i)])}): ").strip()
-        while selection not in [str(j) for j in range(1, i)]:
-            selection = input(f"Please choose a valid option (enter {','.join([str(j) for j in range(1, i)])}): ").strip()
-        selection = param_ranges[param][int(selection) - 1]
-        input_params[param] = convert(selection)
-
-        # removing incompatible possibilities
-        if selection in incompatible_ranges:
-            for ir in incompatible_ranges[selection]:
-                for range_param in param_ranges:
-                    try:
-                        param_ranges[range_param].remove(ir)
-                    except:
-                        pass
-
-    classified_weather_info = "".join([input_params[param] for param in params if input_params[param] != None])
-    # print(classified_weather_info)
+    if model.n_gram == 1:
+        print("To predict the weather in the future, we will start by describing today's weather.")
+    else:
+        print(f"This model's states cover {model.n_gram} days, so to predict the weather in the future, "
+            f"we will start by describing the weather of the last {model.n_gram} days, oldest first.")
+
+    # the code of each day's weather, oldest first
+    day_codes = []
+    for day in range(model.n_gram):
+        if model.n_gram > 1:
+            print(colored(f"\nDay {day + 1} of {model.n_gram}", "white", attrs=["bold"]))
+        # incompatible possibilities are removed per day
+        day_ranges = {param : list(value_ranges) for param, value_ranges in param_ranges.items()}
+        for param in params:
+            print(colored(f"\n{param}) ", "white", attrs=["bold"]), end="")
+            print(f"Select a range for {keywords[param]} ({param}): \n")
+            i = 1
+            for value_range in day_ranges[param]:
+                print(f"[{i}] {value_range}\n")
+                i += 1
+            selection = input(f"Choose an option (enter {','.join([str(j) for j in range(1, i)])}): ").strip()
+            while selection not in [str(j) for j in range(1, i)]:
+                selection = input(f"Please choose a valid option (enter {','.join([str(j) for j in range(1, i)])}): ").strip()
+            selection = day_ranges[param][int(selection) - 1]
+            input_params[param] = markov.PARAM_RANGES[param].index(convert(selection))
+
+            # removing incompatible possibilities
+            if selection in incompatible_ranges:
+                for ir in incompatible_ranges[selection]:
+                    for range_param in day_ranges:
+                        try:
+                            day_ranges[range_param].remove(ir)
+                        except:
+                            pass
+        day_codes.append(markov.encode_state([input_params[param] for param in params], params))
+
+    # an n-gram state combines the codes of its days, oldest first
+    state = 0
+    for code in day_codes:
+        state = state * markov.count_states(params) + code
+    # print(markov.decode_state(state, params, model.n_gram))
     num_days = -1
     while True:
         try:
@@ -195,10 +241,9 @@ attempted from initial state (suggested: 1 ~ 10): """
         except ValueError:
             print("Please enter a valid integer greater than 0.")
 
-    markov_model, generic_model = markov.make_markov_model("data/san_jose_weather.csv", params, 1)
-    make_predictions(classified_weather_info, params, markov_model, generic_model, num_days)
+    make_predictions(state, model, num_days)
     
-def options_after_prediction(markov_model, params):
+def options_after_prediction(model):
     print("\n\nYou have reached the end of the model's forecasts.")
     print("Select [n] to quit the program or [y] to try something else.")
     selection = input("\nEnter y or n: ").strip()
@@ -216,7 +261,7 @@ Options:
         selection = input("Please enter a valid choice (enter 1 or 2): ").strip()
     selection = int(selection)
     if selection == 1:
-        setup_predictions(params, markov_model)
+        setup_predictions(model)
         return
     main_menu()
 
@@ -237,19 +282,18 @@ Keywords:
 "wspd" -> avg windspeed of day in km/h
 
 Available Pre-Built Models:
-
-[1] Model #1: trained on "tavg" and "tmax" 
-[2] Model #2: trained on "tavg", "tmax", and "prcp"
-[3] Model #3: trained on "tavg", "prcp", and "wspd" 
-[4] Model #4: trained on "tavg", "tmax", "tmin", and "prcp"
-[5] Model #5: trained on "tavg", "tmax", "tmin", "prcp", and "wspd"
 """)
+    entries = model_registry.entries()
+    model_list = "\n".join(f"[{i}] Model #{i}: {registry.describe(entry)}" for i, entry in enumerate(entries, 1))
+    print(model_list + "\n")
 
     print_warning()
 
     print(colored("\nPICK A MODEL", "white", attrs=["bold"]))
 
-    setup_text = """
+    choices = [str(i) for i in range(1, len(entries) + 1)] + ["0"]
+    choice_text = ", ".join(choices[:-1]) + ", or 0" if len(choices) > 2 else " or ".join(choices)
+    setup_text = f"""
 Keywords:
 "tavg" -> avg temp of day in °C
 "tmax -> max temp of day in °C
@@ -259,33 +303,20 @@ Keywords:
 
 Available Pre-Built Models:
 
-[1] Model #1: trained on "tavg" and "tmax" 
-[2] Model #2: trained on "tavg", "tmax", and "prcp"
-[3] Model #3: trained on "tavg", "prcp", and "wspd" 
-[4] Model #4: trained on "tavg", "tmax", "tmin", and "prcp"
-[5] Model #5: trained on "tavg", "tmax", "tmin", "prcp", and "wspd"
+{model_list}
 [0] Quit the program
 
-Select an option (enter 1, 2, 3, 4, 5, or 0): """
+Select an option (enter {choice_text}): """
     selection = input(setup_text).strip()
-    while selection not in ["1", "2", "3", "4", "5", "0"]:
-        selection = input("Please enter a valid choice (enter 1, 2, 3, 4, 5, or 0): ").strip()
+    while selection not in choices:
+        selection = input(f"Please enter a valid choice (enter {choice_text}): ").strip()
     selection = int(selection)
     if selection == 0:
         quit()
-    
-    pre_built_models = {
-        1 : ("tavg", "tmax"),
-        2: ("tavg", "tmax", "prcp"),
-        3: ("tavg", "prcp", "wspd"),
-        4: ("tavg", "tmax", "tmin", "prcp"),
-        5: ("tavg", "tmax", "tmin", "prcp", "wspd")
-    }
 
-    file_name = "_".join(param for param in pre_built_models[selection]) + ".json"
-    markov_model = json.load(open("data/pre_built_models/" + file_name))
+    model = model_registry.load(entries[selection - 1])
 
-    setup_predictions(pre_built_models[selection], markov_model)
+    setup_predictions(model)
 
 def make_new_model_and_predict():
     print(colored('\nGENERATING A NEW MODEL', "cyan", attrs=["bold"]))
@@ -326,9 +357,9 @@ def make_new_model_and_predict():
         quit()        
     print("\nGenerating Model...")
     params = [param[0] for param in input_params if param[1]]
-    markov_model = markov.make_markov_model("data/san_jose_weather.csv", params, 1)
+    model = get_model_cache().train("data/san_jose_weather.csv", params, 1)
     print("\nMarkov Model built!")
-    setup_predictions(params, markov_model)
+    setup_predictions(model)
 
 
 
@@ -358,4 +389,24 @@ Select an option (enter 1, 2, or 0): """
         make_new_model_and_predict()
 
 if __name__ == "__main__":
-    main_menu()
+    parser = argparse.ArgumentParser(description="Markov-chain weather forecast model")
+    parser.add_argument("--profile", action="store_true", help="print the time spent in each stage when the program ends")
+    parser.add_argument("--profile-memory", action="store_true", help="like --profile, also measuring peak memory (slower)")
+    parser.add_argument("--batch", nargs="?", const="-", metavar="FILE",
+        help="answer forecast queries (json lines, see batch.py) from FILE or stdin instead of asking interactively")
+    parser.add_argument("--output", metavar="FILE", help="with --batch, write the answers to FILE instead of stdout")
+    args = parser.parse_args()
+    if args.profile or args.profile_memory:
+        import instrument
+        instrument.enable(memory=args.profile_memory)
+        # in batch mode stdout holds the answers, so the profile goes to stderr
+        profile_stream = sys.stderr if args.batch is not None else sys.stdout
+        atexit.register(lambda: print("\n" + instrument.format_profile(), file=profile_stream))
+    if args.batch is not None:
+        import batch
+        input_stream = sys.stdin if args.batch == "-" else open(args.batch)
+        output_stream = open(args.output, 'w') if args.output else sys.stdout
+        with input_stream, output_stream:
+            batch.run_batch(input_stream, output_stream, batch.ModelStore(get_model_cache()))
+    else:
+        main_menu()
@@ -0,0 +1,175 @@
+import itertools
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import markov
+
+# Rolling-origin backtests: how well would a model have forecast the days
+# after each point in the history, had it been trained on the days before?
+#
+# The last part of the history is split into num_folds folds. For each fold,
+# a model is trained on all days before the fold and every day of the fold
+# is used as a forecast origin: the model is started from the state of the
+# n_gram days ending on that day, and its forecast of each of lead_days days
+# ahead is scored against what actually happened. All origins of a fold are
+# forecast together with one matrix product per step.
+#
+# Forecasts are scored on the weather of single days, so that models with
+# different n_grams can be compared: a step of an n-gram model covers n days,
+# and the forecast of each of those days is the marginal of the forecast
+# n-gram state.
+
+# probabilities are clipped to this before taking logarithms, since a model
+# gives probability 0 to transitions it never saw
+EPSILON = 1e-15
+
+# at most this many numbers (states x origins) are forecast at once
+BATCH_SIZE = 1 << 24
+
+# the scores of one configuration at one lead time, averaged over all
+# origins; when there were no origins to forecast from, the scores are NaN
+# and "message" says why
+class BacktestResult:
+    def __init__(self, params, n_gram, sliding, lead, log_loss, brier_score, accuracy, num_forecasts, train_seconds, forecast_seconds, message=None):
+        self.params = tuple(params)
+        self.n_gram = n_gram
+        self.sliding = sliding
+        self.lead = lead
+        self.log_loss = log_loss
+        self.brier_score = brier_score
+        self.accuracy = accuracy
+        self.num_forecasts = num_forecasts
+        self.train_seconds = train_seconds
+        self.forecast_seconds = forecast_seconds
+        self.message = message
+
+    @property
+    def num_states(self):
+        return markov.count_states(self.params, self.n_gram)
+
+# train a model on an array of day states, the same way
+# markov.train_weather_model trains one on a file
+def train_on_days(day_states, params, n_gram, sliding=False):
+    pairs = markov.count_transition_pairs(day_states if sliding else day_states[1:], markov.count_states(params), n_gram, sliding)
+    transition_matrix = markov.sparse_transition_matrix_from_pairs(pairs, markov.count_states(params, n_gram))
+    return markov.WeatherModel(params, n_gram, transition_matrix, sliding=sliding)
+
+# the probabilities of the single-day states at position "position" (0 is
+# the oldest day) of n-gram states, for each column of "vectors"
+def day_marginals(vectors, num_day_states, n_gram, position):
+    shape = (num_day_states ** position, num_day_states, num_day_states ** (n_gram - 1 - position), vectors.shape[1])
+    return vectors.reshape(shape).sum(axis=(0, 2))
+
+# Forecast from every origin and return, for each of lead_days, the
+# forecast probabilities of the observed day: an array of shape
+# (len(lead_days), len(origins), num_day_states), plus the observed day states.
+def forecast_origins(model, day_states, origins, lead_days):
+    num_day_states = markov.count_states(model.params)
+    n_gram = model.n_gram
+    windows = day_states[origins.reshape(-1, 1) + np.arange(1 - n_gram, 1)]
+    codes = markov.combine_day_codes(windows, num_day_states)
+    # lead d is the day at position (d - 1) % n of the state after ceil(d / n) steps
+    steps = [-(-lead // n_gram) for lead in lead_days]
+    probabilities = np.empty((len(lead_days), len(origins), num_day_states))
+    step, dtype = model.step_function()
+    batch_size = max(1, BATCH_SIZE // model.num_states)
+    for first in range(0, len(origins), batch_size):
+        batch = codes[first:first + batch_size]
+        vectors = np.zeros((model.num_states, len(batch)), dtype=dtype)
+        vectors[batch, np.arange(len(batch))] = 1
+        for k in range(1, max(steps) + 1):
+            vectors = step(vectors)
+            for i, lead in enumerate(lead_days):
+                if steps[i] == k:
+                    marginals = day_marginals(vectors, num_day_states, n_gram, (lead - 1) % n_gram)
+                    probabilities[i, first:first + len(batch)] = marginals.T
+    observed = day_states[origins + np.array(lead_days).reshape(-1, 1)]
+    return probabilities, observed
+
+# mean log-loss, Brier score and top-1 accuracy of forecasts
+# "probabilities" (forecasts x states) of the states "observed"
+def score_forecasts(probabilities, observed):
+    rows = np.arange(len(observed))
+    observed_probabilities = probabilities[rows, observed]
+    log_loss = -np.log(np.maximum(observed_probabilities, EPSILON)).mean()
+    brier_score = ((probabilities ** 2).sum(axis=1) - 2 * observed_probabilities + 1).mean()
+    accuracy = (probabilities.argmax(axis=1) == observed).mean()
+    return log_loss, brier_score, accuracy
+
+# Backtest one configuration on an array of day states. Returns one
+# BacktestResult per lead time; training and forecast times are totals over
+# all folds. A history too short for any fold to have an origin (one with
+# n_gram days before it and the longest lead time after it) gets NaN
+# scores and a message instead.
+def backtest_days(day_states, params, n_gram, sliding=False, lead_days=(1, 3, 7), num_folds=5, min_train_fraction=0.5):
+    lead_days = list(lead_days)
+    num_days = len(day_states)
+    cuts = np.linspace(int(num_days * min_train_fraction), num_days, num_folds + 1).astype(np.int64)
+    train_seconds = 0.0
+    forecast_seconds = 0.0
+    fold_probabilities = []
+    fold_observed = []
+    for start, end in zip(cuts[:-1], cuts[1:]):
+        origins = np.arange(max(start, n_gram - 1), min(end, num_days - max(lead_days)))
+        if not len(origins):
+            continue
+        started = time.perf_counter()
+        model = train_on_days(day_states[:start], params, n_gram, sliding)
+        train_seconds += time.perf_counter() - started
+        started = time.perf_counter()
+        probabilities, observed = forecast_origins(model, day_states, origins, lead_days)
+        forecast_seconds += time.perf_counter() - started
+        fold_probabilities.append(probabilities)
+        fold_observed.append(observed)
+    if not fold_probabilities:
+        message = (f"no forecast origins: {num_days} days are too few for {num_folds} folds "
+            f"with n_gram {n_gram} and lead {max(lead_days)}")
+        return [BacktestResult(params, n_gram, sliding, lead, np.nan, np.nan, np.nan, 0, train_seconds, forecast_seconds, message)
+            for lead in lead_days]
+    probabilities = np.concatenate(fold_probabilities, axis=1)
+    observed = np.concatenate(fold_observed, axis=1)
+    results = []
+    for i, lead in enumerate(lead_days):
+        scores = score_forecasts(probabilities[i], observed[i])
+        results.append(BacktestResult(params, n_gram, sliding, lead, *scores, len(observed[i]), train_seconds, forecast_seconds))
+    return results
+
+# Worker: backtest one configuration on a csv file.
+def backtest_file(file_path, params, n_gram, sliding=False, lead_days=(1, 3, 7), num_folds=5, min_train_fraction=0.5):
+    day_states = markov.classify_weather_columns(markov.load_weather_columns(file_path, params), params)
+    return backtest_days(day_states, params, n_gram, sliding, lead_days, num_folds, min_train_fraction)
+
+# every combination of at least one of "params" with each n_gram
+def all_configurations(params=tuple(markov.PARAM_RANGES), n_grams=(1, 2), sliding=False):
+    configurations = []
+    for size in range(1, len(params) + 1):
+        for combination in itertools.combinations(params, size):
+            configurations.extend((list(combination), n_gram, sliding) for n_gram in n_grams)
+    return configurations
+
+# Backtest many (params, n_gram, sliding) configurations on a csv file,
+# spread over a pool of "workers" processes. Returns all BacktestResults.
+def run_backtests(file_path, configurations, lead_days=(1, 3, 7), num_folds=5, min_train_fraction=0.5, workers=None):
+    workers = workers or os.cpu_count() or 1
+    with ProcessPoolExecutor(workers) as pool:
+        jobs = [pool.submit(backtest_file, file_path, params, n_gram, sliding, lead_days, num_folds, min_train_fraction)
+            for params, n_gram, sliding in configurations]
+        return [result for job in jobs for result in job.result()]
+
+# a table of the scores of every configuration at every lead time
+def format_results(results):
+    lines = [f"{'params':<28} {'n':>2} {'slide':>5} {'states':>7} {'lead':>4} {'log-loss':>8} {'brier':>6} "
+        f"{'top-1':>6} {'train s':>8} {'fcst s':>8}"]
+    for result in results:
+        line = f"{'_'.join(result.params):<28} {result.n_gram:>2} {str(result.sliding):>5} {result.num_states:>7} {result.lead:>4} "
+        if result.message:
+            lines.append(line + result.message)
+            continue
+        lines.append(line + f"{result.log_loss:>8.3f} {result.brier_score:>6.3f} {result.accuracy:>6.3f} "
+            f"{result.train_seconds:>8.3f} {result.forecast_seconds:>8.3f}")
+    return "\n".join(lines)
+
+if __name__ == "__main__":
+    configurations = all_configurations()
+    print(format_results(run_backtests("data/san_jose_weather.csv", configurations)))
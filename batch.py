@@ -0,0 +1,230 @@
+import json
+import sys
+from collections import OrderedDict
+from functools import lru_cache
+import numpy as np
+import markov
+import cache
+import registry
+
+# Headless forecasting: answer a stream of forecast queries, one json
+# object per line, with one json line of results each, in the same order.
+#
+# A query looks like
+#   {"id": 7, "params": ["tavg", "prcp"], "state": {"tavg": 21.3, "prcp": 0}, "horizon": 5}
+# where "state" is anything WeatherModel.resolve_states accepts (a state
+# code, a description such as "18 < tavg <= 25; prcp == 0;", a dict of
+# observations or a list of n_gram of them). Optional keys:
+# - "n_gram" (1 to MAX_N_GRAM, default 1) and "sliding" (default false) pick the model
+# - "model": path of a saved model (.npz) to use instead of "params"
+# - "top" (default DEFAULT_TOP): number of most likely states to list per day
+# - "probabilities": if true, also return the probabilities of all states
+# "horizon" is the number of days to forecast, 1 to MAX_HORIZON, and a
+# forecast may hold at most MAX_QUERY_NUMBERS probabilities (days x states).
+# The model for "params" is the pre-built one when there is one, and is
+# otherwise trained on the San Jose data (and cached, see cache.ModelCache).
+#
+# Each model is loaded once. Queries are read CHUNK_QUERIES at a time and
+# those for the same model and horizon are answered together with one
+# batched WeatherModel.forecast call. A query that cannot be answered gets
+# {"id": ..., "error": "..."} and does not stop the others.
+
+PRE_BUILT_DIRECTORY = "data/pre_built_models"
+DATA_FILE = "data/san_jose_weather.csv"
+CHUNK_QUERIES = 4096
+DEFAULT_TOP = 5
+# longest horizon a query may ask for; a forecast holds horizon x num_states numbers
+MAX_HORIZON = 366
+# largest n_gram a query may ask for; a model has (states of one day) ** n_gram states
+MAX_N_GRAM = 3
+# at most this many probabilities (days x states) are forecast for one query
+MAX_QUERY_NUMBERS = 1 << 27
+# at most this many probabilities (queries x days x states) are forecast at once
+BATCH_NUMBERS = 1 << 24
+
+# Finds the model of each query, loading or training every model only once.
+# The models in use are kept, least recently used first out, within the
+# limits of model_cache (trained models are also kept by model_cache itself).
+class ModelStore:
+    def __init__(self, model_cache=None, pre_built_directory=PRE_BUILT_DIRECTORY, data_file=DATA_FILE):
+        self.model_cache = model_cache or cache.ModelCache()
+        self.pre_built_directory = pre_built_directory
+        self.registry = registry.ModelRegistry(pre_built_directory)
+        self.data_file = data_file
+        self._models = OrderedDict()
+
+    # the key of the model of a query that passed check_query
+    def key(self, query):
+        if "model" in query:
+            return ("model", query["model"])
+        return (tuple(query_params(query)), query.get("n_gram", 1), query.get("sliding", False))
+
+    def get(self, key):
+        if key in self._models:
+            self._models.move_to_end(key)
+            return self._models[key]
+        model = self.load(key)
+        self._models[key] = model
+        # like cache.ModelCache, always keep the newest model
+        while len(self._models) > 1 and (len(self._models) > self.model_cache.max_models or
+                sum(loaded.nbytes for loaded in self._models.values()) > self.model_cache.max_bytes):
+            self._models.popitem(last=False)
+        return model
+
+    # the keys of the models loaded so far
+    def loaded_keys(self):
+        return list(self._models)
+
+    # the file the model of "key" is loaded from, or None if it is trained
+    def source_file(self, key):
+        if key[0] == "model":
+            return key[1]
+        entry = self.registry.find(*key)
+        return None if entry is None else self.registry.path(entry)
+
+    def load(self, key):
+        file_path = self.source_file(key)
+        if file_path is not None:
+            return markov.load_markov_model(file_path)
+        params, n_gram, sliding = key
+        return self.model_cache.train(self.data_file, list(params), n_gram, sliding)
+
+# decoding states is the slowest part of formatting answers, so the
+# descriptions of the most recently used states are cached
+@lru_cache(maxsize=1 << 16)
+def state_label(params, n_gram, state):
+    return markov.decode_state(state, params, n_gram).strip()
+
+# the params of a query, as a list
+def query_params(query):
+    params = query["params"]
+    if isinstance(params, str):
+        params = params.split("_")
+    if not isinstance(params, list) or not params:
+        raise ValueError(f"params must be a non-empty list of params, not {params!r}")
+    for param in params:
+        if param not in markov.PARAM_RANGES:
+            raise ValueError(f"unknown param: {param}")
+    if len(set(params)) != len(params):
+        raise ValueError(f"params must not repeat: {params}")
+    return params
+
+# Check everything about a query except its model, so that a bad query
+# fails before it is forecast. Returns its horizon.
+def check_query(query):
+    if not isinstance(query, dict):
+        raise ValueError("a query must be a json object")
+    n_gram = query.get("n_gram", 1)
+    if isinstance(n_gram, bool) or not isinstance(n_gram, int) or not 1 <= n_gram <= MAX_N_GRAM:
+        raise ValueError(f"n_gram must be an integer from 1 to {MAX_N_GRAM}, not {n_gram!r}")
+    if not isinstance(query.get("sliding", False), bool):
+        raise ValueError(f"sliding must be true or false, not {query['sliding']!r}")
+    horizon = query["horizon"]
+    if isinstance(horizon, bool) or not isinstance(horizon, int):
+        raise ValueError(f"horizon must be an integer, not {horizon!r}")
+    if not 1 <= horizon <= MAX_HORIZON:
+        raise ValueError(f"horizon must be from 1 to {MAX_HORIZON}, not {horizon}")
+    # a model that is trained for the query is checked before it is trained
+    if "model" not in query:
+        check_forecast_size(horizon, markov.count_states(query_params(query), n_gram))
+    top = query.get("top", DEFAULT_TOP)
+    if isinstance(top, bool) or not isinstance(top, int) or top < 0:
+        raise ValueError(f"top must be a non-negative integer, not {top!r}")
+    if not isinstance(query.get("probabilities", False), bool):
+        raise ValueError(f"probabilities must be true or false, not {query['probabilities']!r}")
+    state = query["state"]
+    if isinstance(state, bool) or not isinstance(state, (int, str, dict, list)):
+        raise ValueError(f"state must be a state code, a description or observations, not {state!r}")
+    return horizon
+
+def check_forecast_size(horizon, num_states):
+    if horizon * num_states > MAX_QUERY_NUMBERS:
+        raise ValueError(f"a forecast of {horizon} days of {num_states} states is too large")
+
+# the answer to one query from its forecast (horizon x num_states)
+def format_answer(query, model, forecast):
+    top = query.get("top", DEFAULT_TOP)
+    days = []
+    if top > 0:
+        most_likely = np.argsort(-forecast, axis=1, kind="stable")[:, :top]
+    for day, probabilities in enumerate(forecast):
+        answer = {"day" : day + 1}
+        if top > 0:
+            answer["states"] = [{"state" : state_label(model.params, model.n_gram, state),
+                "probability" : float(probabilities[state])} for state in most_likely[day].tolist()]
+        if query.get("probabilities"):
+            answer["probabilities"] = probabilities.tolist()
+        days.append(answer)
+    return {"id" : query.get("id"), "params" : list(model.params), "n_gram" : model.n_gram, "forecast" : days}
+
+def error_answer(query, error):
+    query_id = query.get("id") if isinstance(query, dict) else None
+    return {"id" : query_id, "error" : f"{type(error).__name__}: {error}"}
+
+# Answer a list of queries (dicts), in order. Never raises because of a
+# single query: any error while answering it becomes its error answer.
+def answer_queries(queries, models):
+    answers = [None] * len(queries)
+    # (model key, horizon) -> (model, [(position, state code)]); the model
+    # is kept so that all queries of a group use the same one
+    groups = {}
+    for position, query in enumerate(queries):
+        try:
+            horizon = check_query(query)
+            key = models.key(query)
+            model = models.get(key)
+            check_forecast_size(horizon, model.num_states)
+            code = int(model.resolve_states([query["state"]])[0])
+            groups.setdefault((key, horizon), (model, []))[1].append((position, code))
+        except Exception as error:
+            answers[position] = error_answer(query, error)
+    for (key, horizon), (model, members) in groups.items():
+        batch_size = max(1, BATCH_NUMBERS // (horizon * model.num_states))
+        for first in range(0, len(members), batch_size):
+            batch = members[first:first + batch_size]
+            try:
+                forecasts = model.forecast([code for position, code in batch], horizon)
+            except Exception as error:
+                for position, code in batch:
+                    answers[position] = error_answer(queries[position], error)
+                continue
+            for (position, code), forecast in zip(batch, forecasts):
+                try:
+                    answers[position] = format_answer(queries[position], model, forecast)
+                except Exception as error:
+                    answers[position] = error_answer(queries[position], error)
+    return answers
+
+def parse_query(line):
+    try:
+        return json.loads(line)
+    except ValueError as error:
+        return error
+
+# Read queries from "input_stream" and write the answers to
+# "output_stream" as json lines, CHUNK_QUERIES queries at a time.
+def run_batch(input_stream, output_stream, models=None, chunk_queries=CHUNK_QUERIES):
+    models = models or ModelStore()
+    chunk = []
+    for line in input_stream:
+        if line.strip():
+            chunk.append(parse_query(line))
+        if len(chunk) == chunk_queries:
+            write_answers(chunk, models, output_stream)
+            chunk = []
+    if chunk:
+        write_answers(chunk, models, output_stream)
+
+def write_answers(chunk, models, output_stream):
+    # lines that are not valid json are answered with an error
+    valid = [query for query in chunk if not isinstance(query, Exception)]
+    answers = iter(answer_queries(valid, models))
+    lines = []
+    for query in chunk:
+        answer = error_answer(None, query) if isinstance(query, Exception) else next(answers)
+        lines.append(json.dumps(answer))
+    output_stream.write("\n".join(lines) + "\n")
+    output_stream.flush()
+
+if __name__ == "__main__":
+    run_batch(sys.stdin, sys.stdout)
@@ -0,0 +1,178 @@
+import argparse
+import json
+import os
+import platform
+import subprocess
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+import markov
+import ingest
+import synthetic_weather
+
+# Benchmarks of the main stages of the model, run on synthetic data (see
+# synthetic_weather) so that the results only depend on the number of rows
+# and the seed. For every (params, n_gram) configuration this measures:
+# - ingest: reading and classifying the csv file (rows per second)
+# - make_markov_model: training the dict model
+# - train_weather_model: training the sparse model
+# - train_compact_model: training the model with a CompactTransitionMatrix;
+#   both training records also hold the bytes of the model (model_bytes)
+# - transition_matrix: building the transition matrix from the dict model
+#   (dense with construct_transition_matrix when it fits in
+#   DENSE_STATE_LIMIT states, sparse otherwise)
+# - forecast_step: one step of a single forecast, and of a batch of
+#   BATCH_SIZE forecasts
+# Each benchmark is timed first and then run once more under tracemalloc to
+# find its peak memory, since tracing slows numpy code down a lot.
+# Results are written as json and can be compared with those of another
+# commit using --compare.
+
+PARAM_ORDER = ["tavg", "prcp", "wspd", "tmax", "tmin"]
+BATCH_SIZE = 100
+FORECAST_STEPS = 20
+
+# the results of one benchmark, as stored in the json file
+def make_record(name, params, n_gram, seconds, peak_bytes, rows=None, steps=None, model_bytes=None):
+    record = {"name" : name, "params" : list(params), "n_gram" : n_gram, "seconds" : seconds, "peak_bytes" : peak_bytes}
+    if model_bytes is not None:
+        record["model_bytes"] = model_bytes
+    if rows is not None:
+        record["rows_per_second"] = rows / seconds if seconds else 0.0
+    if steps is not None:
+        record["seconds_per_step"] = seconds / steps
+    return record
+
+# time "function" (best of "repeat" runs), then find its peak memory use
+def measure(function, repeat=1):
+    seconds = float("inf")
+    for i in range(repeat):
+        started = time.perf_counter()
+        result = function()
+        seconds = min(seconds, time.perf_counter() - started)
+    del result
+    tracemalloc.start()
+    function()
+    peak_bytes = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return seconds, peak_bytes
+
+def ingest_file(file_path, params):
+    for day_states in ingest.classify_chunks(ingest.read_weather_chunks(file_path, params), params):
+        pass
+
+# the forecast loop of WeatherModel.forecast, without keeping every day
+def forecast_steps(model, vectors):
+    step = model.step_function()[0]
+    for i in range(FORECAST_STEPS):
+        vectors = step(vectors)
+    return vectors
+
+def benchmark_configuration(file_path, num_rows, params, n_gram, repeat=1):
+    records = []
+    seconds, peak_bytes = measure(lambda: ingest_file(file_path, params), repeat)
+    records.append(make_record("ingest", params, n_gram, seconds, peak_bytes, rows=num_rows))
+    seconds, peak_bytes = measure(lambda: markov.make_markov_model(file_path, params, n_gram, batch=True), repeat)
+    records.append(make_record("make_markov_model", params, n_gram, seconds, peak_bytes, rows=num_rows))
+    for name, compact in [("train_weather_model", False), ("train_compact_model", True)]:
+        seconds, peak_bytes = measure(lambda: markov.train_weather_model(file_path, params, n_gram, compact=compact), repeat)
+        model_bytes = markov.train_weather_model(file_path, params, n_gram, compact=compact).nbytes
+        records.append(make_record(name, params, n_gram, seconds, peak_bytes, rows=num_rows, model_bytes=model_bytes))
+
+    markov_model, generic_model = markov.make_markov_model(file_path, params, n_gram, batch=True)
+    num_states = markov.count_states(params, n_gram)
+    generic_vector = markov.construct_generic_probability_vector(generic_model, num_states)
+    if num_states <= markov.DENSE_STATE_LIMIT:
+        build = lambda: markov.construct_transition_matrix(markov_model, num_states, generic_vector)
+    else:
+        build = lambda: markov.construct_sparse_transition_matrix(markov_model, num_states, generic_vector)
+    seconds, peak_bytes = measure(build, repeat)
+    records.append(make_record("transition_matrix", params, n_gram, seconds, peak_bytes))
+
+    model = markov.train_weather_model(file_path, params, n_gram)
+    for name, batch in [("forecast_step", 1), ("forecast_step_batch", BATCH_SIZE)]:
+        vectors = np.zeros((num_states, batch))
+        vectors[np.arange(batch) % num_states, np.arange(batch)] = 1
+        seconds, peak_bytes = measure(lambda: forecast_steps(model, vectors), repeat)
+        records.append(make_record(name, params, n_gram, seconds, peak_bytes, steps=FORECAST_STEPS))
+    return records
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+            cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        return ""
+
+# Run all benchmarks on a synthetic file of num_rows rows (generated into
+# "data_path" unless it already exists there) and return the results.
+def run_benchmarks(num_rows, param_counts=(1, 3, 5), n_grams=(1, 2), seed=0, data_path=None, repeat=1):
+    if data_path is None:
+        data_path = os.path.join(tempfile.gettempdir(), f"synthetic_weather_{num_rows}_{seed}.csv")
+    if not os.path.exists(data_path):
+        synthetic_weather.generate_weather_csv(data_path, num_rows, seed)
+    records = []
+    for param_count in param_counts:
+        for n_gram in n_grams:
+            records.extend(benchmark_configuration(data_path, num_rows, PARAM_ORDER[:param_count], n_gram, repeat))
+    return {
+        "commit" : git_commit(),
+        "python" : platform.python_version(),
+        "numpy" : np.__version__,
+        "machine" : platform.machine(),
+        "rows" : num_rows,
+        "seed" : seed,
+        "results" : records
+    }
+
+def record_key(record):
+    return (record["name"], tuple(record["params"]), record["n_gram"])
+
+# lines comparing the times of two sets of results, marking those more
+# than "threshold" (a fraction) slower
+def compare_results(old, new, threshold=0.25):
+    old_records = {record_key(record) : record for record in old["results"]}
+    lines = [f"{old.get('commit', '')[:10]} -> {new.get('commit', '')[:10]}"]
+    for record in new["results"]:
+        previous = old_records.get(record_key(record))
+        if previous is None or not previous["seconds"]:
+            continue
+        change = record["seconds"] / previous["seconds"] - 1
+        flag = "  SLOWER" if change > threshold else ""
+        lines.append(f"{record['name']:<20} {'_'.join(record['params']):<26} n={record['n_gram']} "
+            f"{previous['seconds']:>9.4f} s -> {record['seconds']:>9.4f} s ({change:+.0%}){flag}")
+    return "\n".join(lines)
+
+def format_results(results):
+    lines = [f"{results['rows']} rows, commit {results['commit'][:10]}"]
+    for record in results["results"]:
+        extra = ""
+        if "rows_per_second" in record:
+            extra = f"{record['rows_per_second']:>12,.0f} rows/s"
+        elif "seconds_per_step" in record:
+            extra = f"{record['seconds_per_step'] * 1e6:>10,.1f} us/step"
+        lines.append(f"{record['name']:<20} {'_'.join(record['params']):<26} n={record['n_gram']} "
+            f"{record['seconds']:>9.4f} s {record['peak_bytes'] / 1e6:>9.1f} MB {extra}")
+    return "\n".join(lines)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark training and forecasting on synthetic weather data.")
+    parser.add_argument("--rows", type=int, default=1000000, help="number of rows of synthetic data")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--params", type=int, nargs="+", default=[1, 3, 5], help="numbers of params to benchmark")
+    parser.add_argument("--n-gram", type=int, nargs="+", default=[1, 2])
+    parser.add_argument("--repeat", type=int, default=1, help="time each benchmark as the best of this many runs")
+    parser.add_argument("--data", help="where to keep the synthetic csv file")
+    parser.add_argument("--output", help="write the results to this json file")
+    parser.add_argument("--compare", help="compare with the results in this json file")
+    parser.add_argument("--threshold", type=float, default=0.25, help="slowdown (as a fraction) to flag when comparing")
+    args = parser.parse_args()
+    results = run_benchmarks(args.rows, args.params, args.n_gram, args.seed, args.data, args.repeat)
+    print(format_results(results))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            print(compare_results(json.load(f), results, args.threshold))
@@ -0,0 +1,107 @@
+import hashlib
+import os
+from collections import OrderedDict
+import markov
+
+# A cache of trained models, so that training again on unchanged data (or
+# forecasting again with the same model) does not repeat any work.
+# Models are keyed by (params, n_gram, bin edges, hash of the data file,
+# whether sliding windows were used) and kept in memory, least recently
+# used first out, within a limit on their number and total size. If a
+# directory is given, models are also saved there as .npz files, which
+# survive between runs and are evicted the same way when the directory
+# grows beyond max_disk_bytes.
+class ModelCache:
+    def __init__(self, max_models=32, max_bytes=256 << 20, directory=None, max_disk_bytes=1 << 30):
+        self.max_models = max_models
+        self.max_bytes = max_bytes
+        self.directory = directory
+        self.max_disk_bytes = max_disk_bytes
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._models = OrderedDict()
+        # file hashes by (path, size, modification time), so unchanged files are not hashed again
+        self._file_hashes = {}
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+
+    def __len__(self):
+        return len(self._models)
+
+    def __contains__(self, key):
+        return key in self._models
+
+    @property
+    def nbytes(self):
+        return sum(model.nbytes for model in self._models.values())
+
+    def file_hash(self, file_path):
+        stat = os.stat(file_path)
+        signature = (os.path.abspath(file_path), stat.st_size, stat.st_mtime_ns)
+        if signature not in self._file_hashes:
+            self._file_hashes[signature] = markov.file_hash(file_path)
+        return self._file_hashes[signature]
+
+    def make_key(self, file_path, params, n_gram, sliding=False):
+        bin_edges = tuple(tuple(markov.BIN_EDGES[param]) for param in params)
+        return (tuple(params), n_gram, bin_edges, self.file_hash(file_path), sliding)
+
+    def get(self, key):
+        if key in self._models:
+            self._models.move_to_end(key)
+            self.hits += 1
+            return self._models[key]
+        if self.directory is not None:
+            path = self._disk_path(key)
+            if os.path.exists(path):
+                model = markov.load_markov_model(path)
+                # mark as recently used
+                os.utime(path)
+                self.disk_hits += 1
+                self._store(key, model)
+                return model
+        self.misses += 1
+        return None
+
+    def put(self, key, model):
+        self._store(key, model)
+        if self.directory is not None:
+            path = self._disk_path(key)
+            temporary_path = path + ".tmp"
+            with open(temporary_path, 'wb') as f:
+                markov.save_markov_model(model, f)
+            os.replace(temporary_path, path)
+            self._evict_from_disk()
+
+    # the model trained on "file_path", trained with "trainer" only if
+    # it is not cached yet
+    def train(self, file_path, params, n_gram, sliding=False, trainer=markov.train_weather_model):
+        key = self.make_key(file_path, params, n_gram, sliding)
+        model = self.get(key)
+        if model is None:
+            model = trainer(file_path, params, n_gram, sliding=sliding)
+            self.put(key, model)
+        return model
+
+    def clear(self):
+        self._models.clear()
+
+    def _store(self, key, model):
+        self._models[key] = model
+        self._models.move_to_end(key)
+        # always keep the newest model, even if it is over the limit on its own
+        while len(self._models) > 1 and (len(self._models) > self.max_models or self.nbytes > self.max_bytes):
+            self._models.popitem(last=False)
+
+    def _disk_path(self, key):
+        name = hashlib.sha256(repr(key).encode()).hexdigest()[:32]
+        return os.path.join(self.directory, name + ".npz")
+
+    def _evict_from_disk(self):
+        paths = [os.path.join(self.directory, name) for name in os.listdir(self.directory) if name.endswith(".npz")]
+        paths.sort(key=os.path.getmtime)
+        total = sum(os.path.getsize(path) for path in paths)
+        while len(paths) > 1 and total > self.max_disk_bytes:
+            total -= os.path.getsize(paths[0])
+            os.remove(paths.pop(0))
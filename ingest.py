@@ -0,0 +1,176 @@
+import codecs
+import gzip
+import io
+import time
+import markov
+
+# names under which each parameter may appear in the header of a csv file
+COLUMN_ALIASES = {
+    "date" : ["date", "time", "day"],
+    "tavg" : ["tavg", "temp", "temperature", "avg_temp", "mean_temp"],
+    "tmin" : ["tmin", "min_temp", "temp_min"],
+    "tmax" : ["tmax", "max_temp", "temp_max"],
+    "prcp" : ["prcp", "precipitation", "precip", "rain"],
+    "wspd" : ["wspd", "wind_speed", "windspeed", "wind"]
+}
+
+# files are read this many bytes at a time, so memory use does not
+# depend on the size of the file
+CHUNK_BYTES = 1 << 24
+
+# byte order marks, longest first since the utf-32 le mark starts with the utf-16 le mark
+BYTE_ORDER_MARKS = [
+    (codecs.BOM_UTF32_LE, "utf-32"),
+    (codecs.BOM_UTF32_BE, "utf-32"),
+    (codecs.BOM_UTF8, "utf-8-sig"),
+    (codecs.BOM_UTF16_LE, "utf-16"),
+    (codecs.BOM_UTF16_BE, "utf-16")
+]
+
+# Keeps track of how much data went through the pipeline and how fast.
+class IngestStats:
+    def __init__(self):
+        self.rows = 0
+        self.bytes = 0
+        self.chunks = 0
+        self.seconds = 0.0
+
+    @property
+    def rows_per_second(self):
+        return self.rows / self.seconds if self.seconds else 0.0
+
+    def __str__(self):
+        return (f"{self.rows} rows, {self.bytes / 1e6:.1f} MB in {self.chunks} chunks, "
+            f"{self.seconds:.2f} s ({self.rows_per_second:,.0f} rows/s)")
+
+# open a csv file for binary reading, decompressing it if it is gzipped
+def open_weather_file(file_path):
+    with open(file_path, 'rb') as f:
+        magic = f.read(2)
+    if magic == b"\x1f\x8b":
+        return gzip.open(file_path, 'rb')
+    return open(file_path, 'rb')
+
+# find the encoding of a file from its byte order mark, if it has one
+def detect_encoding(start):
+    for mark, encoding in BYTE_ORDER_MARKS:
+        if start.startswith(mark):
+            return encoding
+    try:
+        start.decode("utf-8")
+        return "utf-8"
+    except UnicodeDecodeError as e:
+        # a multi-byte character may have been cut off at the end
+        return "utf-8" if e.start > len(start) - 4 else "latin-1"
+
+def normalize_column_name(name):
+    return name.strip().strip("\ufeff").strip().strip('"\'').strip().lower()
+
+# find the position of each of "params" in a header row
+def find_columns(header, params, aliases=None):
+    names = [normalize_column_name(name) for name in header]
+    columns = []
+    for param in params:
+        candidates = [param] + (aliases or {}).get(param, []) + COLUMN_ALIASES.get(param, [])
+        for candidate in candidates:
+            if candidate.lower() in names:
+                columns.append(names.index(candidate.lower()))
+                break
+        else:
+            raise ValueError(f"no column for {param} in header {header}")
+    return columns
+
+# Read the lines of a (possibly gzipped) csv file in chunks of about
+# chunk_bytes bytes. The first item yielded is the header row, decoded
+# according to the file's encoding; every following item is a bytes
+# object of complete lines, re-encoded as utf-8 if the file is utf-16/32.
+def read_lines_in_chunks(file_path, chunk_bytes=CHUNK_BYTES):
+    with open_weather_file(file_path) as f:
+        start = f.read(1 << 16)
+        encoding = detect_encoding(start)
+        stream = io.BufferedReader(_Prepend(start, f))
+        if encoding in ("utf-8", "utf-8-sig", "latin-1"):
+            # numbers are plain ascii in these encodings, so the bytes can be parsed as they are
+            read = stream.read
+            decode = lambda line: line.decode(encoding, errors="replace")
+        else:
+            text = io.TextIOWrapper(stream, encoding=encoding, newline="")
+            read = lambda size: text.read(size).encode("utf-8")
+            decode = lambda line: line.decode("utf-8")
+        data = b""
+        while b"\n" not in data:
+            chunk = read(chunk_bytes)
+            if not chunk:
+                break
+            data += chunk
+        end = data.find(b"\n") + 1 or len(data)
+        yield decode(data[:end]).strip("\r\n").split(",")
+        rest = data[end:]
+        while True:
+            chunk = read(chunk_bytes)
+            if not chunk:
+                if rest:
+                    yield rest
+                return
+            data = rest + chunk
+            cut = data.rfind(b"\n") + 1
+            rest = data[cut:]
+            if cut:
+                yield data[:cut]
+
+# lets the bytes already read to detect the encoding be read again
+class _Prepend(io.RawIOBase):
+    def __init__(self, start, f):
+        self.start = start
+        self.f = f
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        if self.start:
+            size = min(len(buffer), len(self.start))
+            buffer[:size] = self.start[:size]
+            self.start = self.start[size:]
+            return size
+        data = self.f.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+# Stage 1 of the pipeline: yield the values of "params" (see
+# markov.load_weather_columns) for each chunk of a file.
+def read_weather_chunks(file_path, params, chunk_bytes=CHUNK_BYTES, aliases=None, stats=None):
+    lines = read_lines_in_chunks(file_path, chunk_bytes)
+    columns = find_columns(next(lines), params, aliases)
+    started = time.perf_counter()
+    for data in lines:
+        values = markov.parse_weather_lines(data, columns)
+        if stats is not None:
+            stats.rows += len(values)
+            stats.bytes += len(data)
+            stats.chunks += 1
+            stats.seconds = time.perf_counter() - started
+        yield values
+    if stats is not None:
+        stats.seconds = time.perf_counter() - started
+
+# Stage 2: classify each chunk into day states.
+def classify_chunks(chunks, params):
+    for values in chunks:
+        yield markov.classify_weather_columns(values, params)
+
+# Stage 3: count the transitions of all chunks. Returns transition pairs
+# (see markov.count_transition_pairs).
+def count_chunks(day_state_chunks, params, n_gram, sliding=False):
+    counter = markov.TransitionCounter(markov.count_states(params), n_gram, sliding=sliding)
+    for day_states in day_state_chunks:
+        counter.add(day_states)
+    return counter.pairs
+
+# Train a model on a csv file of any size, holding only one chunk of it in
+# memory at a time. Gives exactly the model markov.train_weather_model does.
+def train_weather_model(file_path, params, n_gram, sliding=False, chunk_bytes=CHUNK_BYTES, aliases=None, stats=None):
+    chunks = read_weather_chunks(file_path, params, chunk_bytes, aliases, stats)
+    pairs = count_chunks(classify_chunks(chunks, params), params, n_gram, sliding)
+    transition_matrix = markov.sparse_transition_matrix_from_pairs(pairs, markov.count_states(params, n_gram))
+    return markov.WeatherModel(params, n_gram, transition_matrix, markov.file_hash(file_path), sliding=sliding)
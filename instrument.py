@@ -0,0 +1,176 @@
+import logging
+import time
+import tracemalloc
+
+# Opt-in instrumentation of the stages of training and forecasting.
+#
+# Code marks a stage with "with instrument.stage(name):" and reports what
+# it did with count() (numbers that add up, like rows read) or gauge()
+# (values where the latest one counts, like matrix density). Nothing is
+# measured until enable() is called: until then stage() returns a shared
+# do-nothing context manager and count() and gauge() return at once, so
+# instrumented code runs at practically full speed. Stages are marked per
+# chunk or per call, never per row.
+#
+# When enabled, every stage records its number of calls and total time
+# and, with memory=True, the peak memory allocated while it ran (measured
+# with tracemalloc, which slows numpy code down noticeably). A stage that
+# is entered again while it is running (e.g. count_transition_pairs called
+# by TransitionCounter.add) is only measured once. After each call of a
+# stage, every hook (see add_hook) is called with a dict describing it.
+
+_enabled = False
+_trace_memory = False
+# whether tracemalloc was started by enable(), so disable() should stop it
+_started_tracing = False
+_hooks = []
+# the stages running right now, innermost last
+_stack = []
+# StageStats of every stage measured so far, by name
+stages = {}
+
+class StageStats:
+    def __init__(self, name):
+        self.name = name
+        self.calls = 0
+        self.seconds = 0.0
+        self.peak_bytes = 0
+        self.counters = {}
+        self.gauges = {}
+
+class _Frame:
+    def __init__(self, name):
+        self.name = name
+        self.nested = any(frame.name == name for frame in _stack)
+        self.values = {}
+        self.peak_bytes = 0
+
+class _Stage:
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        frame = _Frame(self.name)
+        if _trace_memory and not frame.nested:
+            current, peak = tracemalloc.get_traced_memory()
+            _fold_peak(peak)
+            tracemalloc.reset_peak()
+            frame.start_bytes = current
+        _stack.append(frame)
+        frame.started = time.perf_counter()
+        return frame
+
+    def __exit__(self, *exc_info):
+        seconds = time.perf_counter() - _stack[-1].started
+        frame = _stack.pop()
+        if frame.nested:
+            return False
+        stats = _stats(frame.name)
+        stats.calls += 1
+        stats.seconds += seconds
+        event = {"stage" : frame.name, "seconds" : seconds}
+        if _trace_memory:
+            peak = max(tracemalloc.get_traced_memory()[1], frame.peak_bytes)
+            _fold_peak(peak)
+            event["peak_bytes"] = peak - frame.start_bytes
+            stats.peak_bytes = max(stats.peak_bytes, event["peak_bytes"])
+        event.update(frame.values)
+        for hook in _hooks:
+            hook(event)
+        return False
+
+class _NoStage:
+    def __enter__(self):
+        return None
+
+    def __exit__(self, *exc_info):
+        return False
+
+_NO_STAGE = _NoStage()
+
+# tracemalloc has a single peak, which every stage resets when it starts,
+# so the peak seen so far is passed on to the stages still running
+def _fold_peak(peak):
+    for frame in _stack:
+        frame.peak_bytes = max(frame.peak_bytes, peak)
+
+def enable(memory=False):
+    global _enabled, _trace_memory, _started_tracing
+    _enabled = True
+    _trace_memory = memory
+    if memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+        _started_tracing = True
+
+def disable():
+    global _enabled, _trace_memory, _started_tracing
+    _enabled = False
+    _trace_memory = False
+    if _started_tracing:
+        tracemalloc.stop()
+        _started_tracing = False
+
+def is_enabled():
+    return _enabled
+
+def reset():
+    stages.clear()
+
+def stage(name):
+    return _Stage(name) if _enabled else _NO_STAGE
+
+def _stats(name):
+    stats = stages.get(name)
+    if stats is None:
+        stats = stages[name] = StageStats(name)
+    return stats
+
+# add to the counters of a stage, e.g. count("parse", rows=len(values))
+def count(name, **values):
+    if not _enabled:
+        return
+    counters = _stats(name).counters
+    for key, value in values.items():
+        counters[key] = counters.get(key, 0) + value
+    _record(name, values, add=True)
+
+# set gauges of a stage, e.g. gauge("normalize", density=0.01)
+def gauge(name, **values):
+    if not _enabled:
+        return
+    _stats(name).gauges.update(values)
+    _record(name, values, add=False)
+
+# also pass the values on to the hooks of the running call of the stage
+def _record(name, values, add):
+    for frame in reversed(_stack):
+        if frame.name == name and not frame.nested:
+            for key, value in values.items():
+                frame.values[key] = frame.values.get(key, 0) + value if add else value
+            return
+
+# Hooks are called with a dict holding "stage", "seconds", "peak_bytes"
+# (when measuring memory) and any counters and gauges reported during the
+# call, after every call of a stage.
+def add_hook(hook):
+    _hooks.append(hook)
+
+def remove_hook(hook):
+    _hooks.remove(hook)
+
+# a hook that writes every event to a logger
+def logging_hook(logger=None, level=logging.INFO):
+    logger = logger or logging.getLogger("markov.instrument")
+    def hook(event):
+        logger.log(level, " ".join(f"{key}={value}" for key, value in event.items()))
+    return hook
+
+# a table of the time, memory, counters and gauges of every stage
+def format_profile():
+    lines = [f"{'stage':<20} {'calls':>6} {'seconds':>9} {'peak MB':>8}  details"]
+    for stats in stages.values():
+        details = [f"{key}={value:,}" if isinstance(value, int) else f"{key}={value:.4g}"
+            for key, value in list(stats.counters.items()) + list(stats.gauges.items())]
+        peak = f"{stats.peak_bytes / 1e6:>8.1f}" if _trace_memory or stats.peak_bytes else f"{'-':>8}"
+        lines.append(f"{stats.name:<20} {stats.calls:>6} {stats.seconds:>9.4f} {peak}  {' '.join(details)}")
+    return "\n".join(lines)
@@ -0,0 +1,109 @@
+import argparse
+import asyncio
+import json
+import random
+import time
+import numpy as np
+
+# Load generator for server.py: opens many concurrent client connections,
+# each sending forecast requests one after another over keep-alive HTTP,
+# and reports throughput and latency percentiles for each number of
+# clients. With the server coalescing concurrent requests, tail latency
+# should stay about flat as the number of clients grows.
+#
+#   python3 server.py &
+#   python3 load_generator.py --clients 10 100 400 --requests 50
+
+PARAM_SETS = [
+    ["tavg", "tmax"],
+    ["tavg", "tmax", "prcp"],
+    ["tavg", "prcp", "wspd"],
+    ["tavg", "tmax", "tmin", "prcp"],
+    ["tavg", "tmax", "tmin", "prcp", "wspd"]
+]
+
+def random_query(rng, query_id):
+    observation = {
+        "tavg" : rng.uniform(5, 30),
+        "tmax" : rng.uniform(10, 35),
+        "tmin" : rng.uniform(0, 20),
+        "prcp" : rng.choice([0, 0, 0, 2, 7, 15]),
+        "wspd" : rng.uniform(0, 15)
+    }
+    return {"id" : query_id, "params" : rng.choice(PARAM_SETS), "state" : observation, "horizon" : rng.choice([1, 3, 7])}
+
+async def open_connection(host, port, unix_path):
+    if unix_path is not None:
+        return await asyncio.open_unix_connection(unix_path)
+    return await asyncio.open_connection(host, port)
+
+async def post(reader, writer, host, body):
+    writer.write((f"POST /forecast HTTP/1.1\r\nHost: {host}\r\nContent-Type: application/json\r\n"
+        f"Content-Length: {len(body)}\r\n\r\n").encode("latin-1") + body)
+    await writer.drain()
+    status = (await reader.readline()).split()[1]
+    length = 0
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        if name.strip().lower() == "content-length":
+            length = int(value)
+    await reader.readexactly(length)
+    return int(status)
+
+# one client: send "num_requests" requests, recording the latency of each
+async def run_client(client, num_requests, latencies, errors, host, port, unix_path, seed):
+    rng = random.Random(seed * 100003 + client)
+    reader, writer = await open_connection(host, port, unix_path)
+    try:
+        for i in range(num_requests):
+            body = json.dumps(random_query(rng, i)).encode()
+            started = time.perf_counter()
+            status = await post(reader, writer, host, body)
+            latencies.append(time.perf_counter() - started)
+            if status != 200:
+                errors.append(status)
+    finally:
+        writer.close()
+
+async def run_load(num_clients, num_requests, host="127.0.0.1", port=8080, unix_path=None, seed=0):
+    latencies = []
+    errors = []
+    started = time.perf_counter()
+    await asyncio.gather(*[run_client(client, num_requests, latencies, errors, host, port, unix_path, seed)
+        for client in range(num_clients)])
+    seconds = time.perf_counter() - started
+    latencies = np.array(latencies) * 1000
+    return {
+        "clients" : num_clients,
+        "requests" : len(latencies),
+        "errors" : len(errors),
+        "requests_per_second" : len(latencies) / seconds,
+        "p50_ms" : float(np.percentile(latencies, 50)),
+        "p90_ms" : float(np.percentile(latencies, 90)),
+        "p99_ms" : float(np.percentile(latencies, 99)),
+        "max_ms" : float(latencies.max())
+    }
+
+def format_result(result):
+    return (f"{result['clients']:>7} {result['requests']:>8} {result['errors']:>6} {result['requests_per_second']:>9,.0f} "
+        f"{result['p50_ms']:>8.2f} {result['p90_ms']:>8.2f} {result['p99_ms']:>8.2f} {result['max_ms']:>8.2f}")
+
+async def main(args):
+    # warm up, so that loading the models is not counted
+    await run_load(len(PARAM_SETS), 10, args.host, args.port, args.unix, args.seed)
+    print(f"{'clients':>7} {'requests':>8} {'errors':>6} {'req/s':>9} {'p50 ms':>8} {'p90 ms':>8} {'p99 ms':>8} {'max ms':>8}")
+    for num_clients in args.clients:
+        print(format_result(await run_load(num_clients, args.requests, args.host, args.port, args.unix, args.seed)))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Send concurrent forecast requests to server.py and report latency.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--unix", metavar="PATH", help="connect to a unix socket instead of a TCP port")
+    parser.add_argument("--clients", type=int, nargs="+", default=[10, 100, 400], help="numbers of concurrent clients to try")
+    parser.add_argument("--requests", type=int, default=50, help="requests sent by each client")
+    parser.add_argument("--seed", type=int, default=0)
+    asyncio.run(main(parser.parse_args()))
@@ -1,8 +1,13 @@
 from csv import DictReader, reader
-import json
+import io
+import hashlib
+import numbers
+import operator
 from datetime import date, time, datetime
 import numpy as np # for matrix multiplication
 import itertools
+from bisect import bisect_left
+import instrument
 
 
 # A function to check if date is within desired range.
@@ -11,6 +16,112 @@ def is_within_date_range(date):
     date = int(date[8:10])
     return (month >= 9 and month <= 11)
 
+# The possible ranges ("bins") of each parameter. A bin is identified by its
+# position in the parameter's list, and the lists are ordered the same way as
+# the states produced by construct_states_vector_template.
+PARAM_RANGES = {
+    "tavg" : ["18 < tavg <= 25; ", "tavg <= 18; ", "25 < tavg; "],
+    "tmin" : ["tmin <= 18; ", "18 < tmin; "],
+    "tmax" : ["18 < tmax <= 25; ", "tmax <= 18; ", "25 < tmax; "],
+    "prcp" : ["prcp == 0; ", "0 < prcp <= 5; ", "5 < prcp <= 10; ", "10 < prcp; "],
+    "wspd" : ["wspd <= 5; ", "5 < wspd <= 10; ", "10 < wspd; "]
+}
+
+# thresholds separating the bins of each parameter; a value v falls into
+# interval i when BIN_EDGES[param][i-1] < v <= BIN_EDGES[param][i]
+BIN_EDGES = {
+    "tavg" : (18, 25),
+    "tmin" : (18,),
+    "tmax" : (18, 25),
+    "prcp" : (0, 5, 10),
+    "wspd" : (5, 10)
+}
+
+# maps each interval of BIN_EDGES to its position in PARAM_RANGES
+BIN_CODES = {
+    "tavg" : (1, 0, 2),
+    "tmin" : (0, 1),
+    "tmax" : (1, 0, 2),
+    "prcp" : (0, 1, 2, 3),
+    "wspd" : (0, 1, 2)
+}
+
+# if data is somehow missing, assume typical temperatures, no rain and moderate wind
+MISSING_CODES = {
+    "tavg" : 0,
+    "tmin" : 1,
+    "tmax" : 0,
+    "prcp" : 0,
+    "wspd" : 0
+}
+
+# number of states of a model trained on "params", where each state
+# describes "n_gram" consecutive days
+def count_states(params, n_gram=1):
+    num_states = 1
+    for param in params:
+        num_states *= len(PARAM_RANGES[param])
+    return num_states ** n_gram
+
+# find the bin code of a single value of the given parameter
+def classify_value(param, value):
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return MISSING_CODES[param]
+    if value != value:
+        return MISSING_CODES[param]
+    return BIN_CODES[param][bisect_left(BIN_EDGES[param], value)]
+
+# combine the bin codes of one day into a single state code. States are
+# numbered in mixed radix, with the first parameter as the most significant
+# digit, so a state's code is its index in construct_states_vector_template.
+def encode_state(bin_codes, params):
+    state = 0
+    for param, code in zip(params, bin_codes):
+        state = state * len(PARAM_RANGES[param]) + code
+    return state
+
+# analyze and categorize weather info into a state code of a Markov model.
+# only tavg, tmin, tmax, prcp, and wspd will be considered,
+# if available. Other data will be silently ignored.
+def encode_weather_info(weather_info):
+    state = 0
+    for param, value in weather_info:
+        if param in PARAM_RANGES:
+            state = state * len(PARAM_RANGES[param]) + classify_value(param, value)
+    return state
+
+# convert a state code back into its human-readable description,
+# e.g. "18 < tavg <= 25; prcp == 0; "
+def decode_state(state, params, n_gram=1):
+    bits = []
+    for _ in range(n_gram):
+        for param in reversed(params):
+            state, code = divmod(state, len(PARAM_RANGES[param]))
+            bits.append(PARAM_RANGES[param][code])
+    return "".join(reversed(bits))
+
+# inverse of decode_state: find the code of a state description
+def encode_state_label(label, params, n_gram=1):
+    bits = [bit + "; " for bit in label.strip().rstrip(";").split("; ")]
+    if len(bits) != len(params) * n_gram:
+        raise ValueError(f"{label!r} does not describe {n_gram} day(s) of {', '.join(params)}")
+    state = 0
+    for i, bit in enumerate(bits):
+        param = params[i % len(params)]
+        state = state * len(PARAM_RANGES[param]) + PARAM_RANGES[param].index(bit)
+    return state
+
+# find the code of the state made of consecutive days of raw observations,
+# each a dict such as {"tavg": 20.1, "prcp": 0}, oldest day first
+def encode_observations(observations, params):
+    num_states = count_states(params)
+    state = 0
+    for observation in observations:
+        state = state * num_states + encode_weather_info((param, observation.get(param)) for param in params)
+    return state
+
 # analyze and categorize weather info into a "state" of a Markov model
 # only date, tavg, tmin, tmax, prcp, and wspd will be considered, 
 # if available. Other data will be silently ignored. 
@@ -19,46 +130,8 @@ def classify_weather_info(weather_info):
     for param, value in weather_info:
         if param == "\ufeffdate": 
             state += value[5:7] + "; "
-        elif param == "tavg" or param == "tmax" or param == "tmin":
-            try:
-                value = float(value)
-            except:
-                # if temperature data somehow missing, assume typical weather
-                if param == "tmin":
-                    state += f"18 < {param}; "
-                else:
-                    state += f"18 < {param} <= 25; "
-                continue
-            if value <= 18:
-                state += f"{param} <= 18; "
-            elif value <= 25:
-                if param == "tmin":
-                    state += f"18 < {param}; "
-                else:
-                    state += f"18 < {param} <= 25; "
-            else:
-                if param == "tmin":
-                    state += f"18 < {param}; "
-                else:
-                    state += f"25 < {param}; "
-        elif param == "prcp" or param == "wspd":
-            try:
-                value = float(value)
-            except:
-                # if temperature data somehow missing, assume no rain or moderate wind
-                state += f"{param} == 0; " if param == "prcp" else f"{param} <= 5; "
-                continue
-            if value == 0 and param == "prcp":
-                state += f"{param} == 0; "
-            elif value <= 5:
-                if param == "prcp":
-                    state += f"0 < {param} <= 5; "
-                else:
-                    state += f"{param} <= 5; "
-            elif value <= 10:
-                state += f"5 < {param} <= 10; "
-            else:
-                state += f"10 < {param}; "
+        elif param in PARAM_RANGES:
+            state += PARAM_RANGES[param][classify_value(param, value)]
     return state
 
 def insert_into_markov_model(markov_model, current_state, next_state):
@@ -70,83 +143,328 @@ def insert_into_markov_model(markov_model, current_state, next_state):
     else:
         markov_model[current_state] = { next_state : 1 }
 
+# Reads a stream of daily state codes into transitions: n days form the
+# current state, the following n days form the next state, and the day
+# after that is skipped before the next block starts.
+class BlockTransitionReader:
+    def __init__(self, num_states, n_gram):
+        self.num_states = num_states
+        self.n_gram = n_gram
+        self.current_state = 0
+        self.len_curr = 0
+        self.next_state = 0
+        self.len_next = 0
+
+    # returns the (current, next) transition completed by this day, if any
+    def add(self, day_state):
+        if self.len_curr != self.n_gram:
+            self.current_state = self.current_state * self.num_states + day_state
+            self.len_curr += 1
+        elif self.len_next != self.n_gram:
+            self.next_state = self.next_state * self.num_states + day_state
+            self.len_next += 1
+        else:
+            transition = (self.current_state, self.next_state)
+            self.current_state = 0
+            self.len_curr = 0
+            self.next_state = 0
+            self.len_next = 0
+            return transition
+        return None
+
+# Reads a stream of daily state codes into overlapping transitions: every
+# window of 2n consecutive days gives one transition from its first n days
+# to its last n days, so no day is thrown away. The last 2n days are kept
+# in a ring buffer, and both states are updated in O(1) per day by shifting
+# one day into them (and the oldest day out, modulo |states|^n).
+class SlidingTransitionReader:
+    def __init__(self, num_states, n_gram):
+        self.num_states = num_states
+        self.n_gram = n_gram
+        self.modulus = num_states ** n_gram
+        self.days = [0] * (2 * n_gram)
+        self.position = 0
+        self.current_state = 0
+        self.next_state = 0
+
+    # returns the (current, next) transition completed by this day, if any
+    def add(self, day_state):
+        # the day leaving the next state enters the current state
+        leaving = self.days[(self.position - self.n_gram) % len(self.days)]
+        self.days[self.position % len(self.days)] = day_state
+        if self.position >= self.n_gram:
+            self.current_state = (self.current_state * self.num_states + leaving) % self.modulus
+        self.next_state = (self.next_state * self.num_states + day_state) % self.modulus
+        self.position += 1
+        if self.position >= len(self.days):
+            return (self.current_state, self.next_state)
+        return None
+
 # Requirements: "file_path" must be a csv file, "params" must be an iterable
 # Possible values for "params":
 # tavg,tmin,tmax,prcp,wspd
-def make_markov_model(file_path, params, n_gram):
+# States are integer codes (see encode_state); an n-gram state combines
+# the codes of n consecutive days, with the oldest day most significant.
+# With batch=True the file is read and counted with NumPy (see
+# make_transition_counts), which gives exactly the same model much faster.
+# With sliding=True every window of 2n consecutive days is a transition
+# (see SlidingTransitionReader); otherwise the days are read in separate
+# blocks (see BlockTransitionReader).
+def make_markov_model(file_path, params, n_gram, batch=False, sliding=False):
+    if batch:
+        return markov_model_from_pairs(make_transition_counts(file_path, params, n_gram, sparse=True, sliding=sliding))
     raw_frequencies = {}
-    with open(file_path, 'r') as csv_file:
+    num_states = count_states(params)
+    # rows are parsed, classified and counted one at a time, so they are
+    # measured together as a single stage
+    with instrument.stage("read_rows"), open(file_path, 'r') as csv_file:
         csv_reader = DictReader(csv_file)
-        # skip first line
-        next(csv_reader)
-        current_state = ""
-        len_curr = 0
-        next_state = ""
-        len_next = 0
+        if sliding:
+            transitions = SlidingTransitionReader(num_states, n_gram)
+        else:
+            # skip first line
+            next(csv_reader)
+            transitions = BlockTransitionReader(num_states, n_gram)
+        rows = 0
+        num_transitions = 0
         for row in csv_reader:
-            date = row["\ufeffdate"]
+            rows += 1
             weather_info = ((param, row[param]) for param in params)
-            if len_curr != n_gram:
-                current_state += classify_weather_info(weather_info)
-                len_curr += 1
-            elif len_next != n_gram:
-                next_state += classify_weather_info(weather_info)
-                len_next += 1
-            else:
-                insert_into_markov_model(raw_frequencies, current_state, next_state)
-                current_state = ""
-                len_curr = 0
-                next_state = ""
-                len_next = 0
-
-    # a model that holds pr(transitioning into state A | currently in state B)
-    markov_model = {}
-    # a generic model that holds pr(transitioning into state A)
-    generic_probabilities = {}
-
-    total = 0
-    for curr in raw_frequencies:
-        markov_model[curr] = {}
-        sub_total = 0
-        for future in raw_frequencies[curr]:
-            sub_total += raw_frequencies[curr][future]
-            total += raw_frequencies[curr][future]
-        for future in raw_frequencies[curr]:
-            markov_model[curr][future] = raw_frequencies[curr][future] / sub_total
-            if future in generic_probabilities:
-                generic_probabilities[future] += raw_frequencies[curr][future]
-            else:
-                generic_probabilities[future] = raw_frequencies[curr][future]
-    for possibility in generic_probabilities:
-        generic_probabilities[possibility] /= total
+            transition = transitions.add(encode_weather_info(weather_info))
+            if transition is not None:
+                num_transitions += 1
+                insert_into_markov_model(raw_frequencies, *transition)
+        instrument.count("read_rows", rows=rows, transitions=num_transitions)
+
+    with instrument.stage("normalize"):
+        # a model that holds pr(transitioning into state A | currently in state B)
+        markov_model = {}
+        # a generic model that holds pr(transitioning into state A)
+        generic_probabilities = {}
+
+        total = 0
+        for curr in raw_frequencies:
+            markov_model[curr] = {}
+            sub_total = 0
+            for future in raw_frequencies[curr]:
+                sub_total += raw_frequencies[curr][future]
+                total += raw_frequencies[curr][future]
+            for future in raw_frequencies[curr]:
+                markov_model[curr][future] = raw_frequencies[curr][future] / sub_total
+                if future in generic_probabilities:
+                    generic_probabilities[future] += raw_frequencies[curr][future]
+                else:
+                    generic_probabilities[future] = raw_frequencies[curr][future]
+        for possibility in generic_probabilities:
+            generic_probabilities[possibility] /= total
+        instrument.gauge("normalize", states_observed=len(markov_model))
 
     return markov_model, generic_probabilities
 
-def print_markov_model(model):
+# read the columns of "params" from a csv file into a float array with one
+# row per day and one column per parameter; missing values become NaN
+def load_weather_columns(file_path, params):
+    with open(file_path, 'r') as csv_file:
+        header = next(reader(csv_file))
+    columns = [header.index(param) for param in params]
+    with open(file_path, 'rb') as csv_file:
+        csv_file.readline()
+        return parse_weather_lines(csv_file.read(), columns)
+
+# parse complete csv lines (bytes, without the header) into a float array
+# holding the given columns; missing values become NaN
+def parse_weather_lines(data, columns):
+    with instrument.stage("parse"):
+        num_bytes = len(data)
+        # the C parser of np.loadtxt cannot handle empty fields, so spell them out
+        data = data.replace(b"\r\n", b"\n")
+        if data and not data.endswith(b"\n"):
+            data += b"\n"
+        data = data.replace(b",,", b",nan,").replace(b",,", b",nan,").replace(b",\n", b",nan\n")
+        try:
+            values = np.loadtxt(io.BytesIO(data), delimiter=",", usecols=columns, ndmin=2).reshape(-1, len(columns))
+        except ValueError:
+            # some values are not numbers at all; parse row by row instead
+            rows = reader(io.StringIO(data.decode(errors="replace")))
+            values = [[parse_value(row[column]) if column < len(row) else np.nan for column in columns] for row in rows if row]
+            values = np.array(values, dtype=float).reshape(-1, len(columns))
+        instrument.count("parse", rows=len(values), bytes=num_bytes)
+        return values
+
+def parse_value(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
+
+# vectorized equivalent of encode_weather_info, for a whole array of days
+# (as returned by load_weather_columns) at once
+def classify_weather_columns(values, params):
+    with instrument.stage("classify"):
+        states = np.zeros(len(values), dtype=np.int64)
+        for i, param in enumerate(params):
+            column = values[:, i]
+            codes = np.asarray(BIN_CODES[param])[np.digitize(column, BIN_EDGES[param], right=True)]
+            codes[np.isnan(column)] = MISSING_CODES[param]
+            states = states * len(PARAM_RANGES[param]) + codes
+        instrument.count("classify", rows=len(values))
+        return states
+
+# combine the state codes of consecutive days (the columns of "days")
+# into n-gram state codes, with the oldest day most significant
+def combine_day_codes(days, num_states):
+    states = np.zeros(len(days), dtype=np.int64)
+    for i in range(days.shape[1]):
+        states = states * num_states + days[:, i]
+    return states
+
+# the (current, next) state of every transition in an array of day states,
+# read in blocks or in sliding windows like make_markov_model
+def find_transitions(day_states, num_states, n_gram, sliding=False):
+    if sliding:
+        if len(day_states) < 2 * n_gram:
+            no_states = np.zeros(0, dtype=np.int64)
+            return no_states, no_states
+        states = combine_day_codes(np.lib.stride_tricks.sliding_window_view(day_states, n_gram), num_states)
+        return states[:-n_gram], states[n_gram:]
+    block = 2 * n_gram + 1
+    num_blocks = len(day_states) // block
+    blocks = day_states[:num_blocks * block].reshape(num_blocks, block)
+    return combine_day_codes(blocks[:, :n_gram], num_states), combine_day_codes(blocks[:, n_gram:2 * n_gram], num_states)
+
+# count transitions the same way make_markov_model does: by default n days
+# form the current state, the following n days form the next state, and the
+# day after that is skipped before the next block starts; with sliding=True
+# every window of 2n days is counted.
+# Returns a matrix where counts[next, current] is the number of observed
+# transitions from "current" into "next".
+def count_transitions(day_states, num_states, n_gram, sliding=False):
+    with instrument.stage("count"):
+        current_states, next_states = find_transitions(day_states, num_states, n_gram, sliding)
+        num_ngram_states = num_states ** n_gram
+        counts = np.bincount(next_states * num_ngram_states + current_states, minlength=num_ngram_states ** 2)
+        instrument.count("count", transitions=len(current_states))
+        return counts.reshape(num_ngram_states, num_ngram_states)
+
+# sparse version of count_transitions, holding only the observed transitions:
+# returns (current_states, next_states, counts) arrays, sorted by current
+# state and then by next state
+def count_transition_pairs(day_states, num_states, n_gram, sliding=False):
+    with instrument.stage("count"):
+        current_states, next_states = find_transitions(day_states, num_states, n_gram, sliding)
+        instrument.count("count", transitions=len(current_states))
+        return make_transition_pairs(current_states, next_states, num_states ** n_gram)
+
+# group individual transitions into (current_states, next_states, counts);
+# "weights" optionally gives the number of times each transition was seen
+def make_transition_pairs(current_states, next_states, num_ngram_states, weights=None):
+    pairs, inverse = np.unique(current_states * num_ngram_states + next_states, return_inverse=True)
+    if weights is None:
+        counts = np.bincount(inverse, minlength=len(pairs))
+    else:
+        counts = np.bincount(inverse, weights=weights, minlength=len(pairs)).astype(np.int64)
+    current_states, next_states = np.divmod(pairs, num_ngram_states)
+    return current_states, next_states, counts
+
+# convert a dense matrix of counts (see count_transitions) into transition pairs
+def transition_pairs_from_matrix(counts):
+    current_states, next_states = np.nonzero(counts.T)
+    return current_states, next_states, counts[next_states, current_states]
+
+# add up several sets of transition pairs
+def merge_transition_pairs(pairs_list, num_ngram_states):
+    current_states = np.concatenate([pairs[0] for pairs in pairs_list])
+    next_states = np.concatenate([pairs[1] for pairs in pairs_list])
+    counts = np.concatenate([pairs[2] for pairs in pairs_list])
+    return make_transition_pairs(current_states, next_states, num_ngram_states, weights=counts)
+
+# Counts transitions like count_transition_pairs over a stream of chunks of
+# day states. Days of an unfinished block (or, with sliding=True, the last
+# 2n - 1 days) are carried over to the next chunk, so the result does not
+# depend on where the chunks are split.
+# The first "skip_days" days are ignored; by default that is the first
+# line when reading blocks, like make_markov_model.
+class TransitionCounter:
+    def __init__(self, num_states, n_gram, skip_days=None, sliding=False):
+        self.num_states = num_states
+        self.n_gram = n_gram
+        self.num_ngram_states = num_states ** n_gram
+        self.sliding = sliding
+        self.skip_days = skip_days if skip_days is not None else (0 if sliding else 1)
+        self.days = 0
+        self.pending = np.zeros(0, dtype=np.int64)
+        no_states = np.zeros(0, dtype=np.int64)
+        self.pairs = (no_states, no_states, no_states)
+
+    def add(self, day_states):
+        self.days += len(day_states)
+        day_states = np.concatenate([self.pending, day_states])
+        if self.skip_days:
+            skipped = min(self.skip_days, len(day_states))
+            day_states = day_states[skipped:]
+            self.skip_days -= skipped
+        if self.sliding:
+            complete = len(day_states)
+            self.pending = day_states[max(0, complete - 2 * self.n_gram + 1):]
+        else:
+            block = 2 * self.n_gram + 1
+            complete = len(day_states) // block * block
+            self.pending = day_states[complete:]
+        if complete:
+            with instrument.stage("count"):
+                pairs = count_transition_pairs(day_states[:complete], self.num_states, self.n_gram, self.sliding)
+                self.pairs = merge_transition_pairs([self.pairs, pairs], self.num_ngram_states)
+
+# With sparse=True the counts are returned as transition pairs
+# (see count_transition_pairs) instead of a |states| x |states| matrix.
+def make_transition_counts(file_path, params, n_gram, sparse=False, sliding=False):
+    values = load_weather_columns(file_path, params)
+    day_states = classify_weather_columns(values, params)
+    if not sliding:
+        # skip first line, like make_markov_model
+        day_states = day_states[1:]
+    if sparse:
+        return count_transition_pairs(day_states, count_states(params), n_gram, sliding)
+    return count_transitions(day_states, count_states(params), n_gram, sliding)
+
+# build the same (markov_model, generic_probabilities) pair as
+# make_markov_model from a matrix of transition counts
+def markov_model_from_counts(counts):
+    return markov_model_from_pairs(transition_pairs_from_matrix(counts))
+
+def markov_model_from_pairs(pairs):
+    with instrument.stage("normalize"):
+        current_states, next_states, counts = pairs
+        markov_model = {}
+        states, starts = np.unique(current_states, return_index=True)
+        ends = np.append(starts[1:], len(counts))
+        state_totals = np.add.reduceat(counts, starts)
+        total = int(counts.sum())
+        for state, start, end, state_total in zip(states.tolist(), starts, ends, state_totals):
+            probabilities = counts[start:end] / state_total
+            markov_model[state] = dict(zip(next_states[start:end].tolist(), probabilities.tolist()))
+        futures, inverse = np.unique(next_states, return_inverse=True)
+        future_totals = np.bincount(inverse, weights=counts, minlength=len(futures))
+        generic_probabilities = dict(zip(futures.tolist(), (future_totals / total).tolist()))
+        instrument.gauge("normalize", states_observed=len(markov_model))
+        return markov_model, generic_probabilities
+
+def print_markov_model(model, params, n_gram=1):
     for state in model:
-        print(f"Current State: {state}")
+        print(f"Current State: {decode_state(state, params, n_gram)}")
         for future in model[state]:
-            print(f"One possible future: {future} count: {model[state][future]}")
+            print(f"One possible future: {decode_state(future, params, n_gram)} count: {model[state][future]}")
         print("\n")
 
-def save_markov_model(model):
-    with open(f"data/pre_built_models/model_created_on_{date.today()}_{datetime.now().time()}.json", 'w', encoding='utf-8') as f: 
-        json.dump(model, f, ensure_ascii=False, indent=4) 
-
 # construct a python vector containing all potential weather conditions 
 # (each weather condition represents a state of the Markov chain) that
-# can be constructed as combinations of the possible values of the given parameters 
-def construct_states_vector_template(params):
-    vec = []
-    param_values = {
-        "tavg" : ["18 < tavg <= 25; ", "tavg <= 18; ", "25 < tavg; "],
-        "tmin" : ["tmin <= 18; ", "18 < tmin; "],
-        "tmax" : ["18 < tmax <= 25; ", "tmax <= 18; ", "25 < tmax; "],
-        "prcp" : ["prcp == 0; ", "0 < prcp <= 5; ", "5 < prcp <= 10; ", "10 < prcp; "],
-        "wspd" : ["wspd <= 5; ", "5 < wspd <= 10; ", "10 < wspd; "]
-    }
-    param_values = [param_values[param] for param in params]
+# can be constructed as combinations of the possible values of the given parameters.
+# The index of each weather condition is its state code.
+def construct_states_vector_template(params, n_gram=1):
+    param_values = [PARAM_RANGES[param] for param in params]
     combinations = ["".join(combo) for combo in itertools.product(*param_values)]
+    if n_gram > 1:
+        combinations = ["".join(combo) for combo in itertools.product(combinations, repeat=n_gram)]
     
     return combinations
 
@@ -157,55 +475,654 @@ def construct_states_vector_template(params):
 # the following function computes p(entering some state A).
 # These generic probabilities will be used for states in 
 # the Markov chain which have never been observed in the sample data. 
-def construct_generic_probability_vector(generic_model, all_possibilities):
-    vec = []
-    for possibility in all_possibilities:
-        if possibility in generic_model:
-            vec.append(generic_model[possibility])
-        else:
-            vec.append(0)
-    return np.array(vec)
+def construct_generic_probability_vector(generic_model, num_states):
+    vec = np.zeros(num_states)
+    for possibility, probability in generic_model.items():
+        vec[possibility] = probability
+    return vec
 
 # construct a numpy vector containing probabilities of all possible weather conditions 
 # that can occur after the given state.
 # If a given state was never observed in the training data, the generic vector will be used.
-# all_possibilities must be a vector constructed using "construct_states_vector_template(params)"
-def construct_state_probability_vector(markov_model, all_possibilities, state, generic_vector):
-    vec = []
+# num_states must be the number of states of the model (see count_states)
+def construct_state_probability_vector(markov_model, num_states, state, generic_vector):
     if state in markov_model:
-        probabilities = markov_model[state]
-        for possibility in all_possibilities:
-            if possibility in probabilities:
-                vec.append(markov_model[state][possibility])
-            else:
-                vec.append(0)
-        return np.array(vec)
+        vec = np.zeros(num_states)
+        for possibility, probability in markov_model[state].items():
+            vec[possibility] = probability
+        return vec
     else:
         return generic_vector
 
-def construct_transition_matrix(markov_model, all_possibilities, generic_vector):
-    col_vecs = []
-    for possibility in all_possibilities:
-        vec = construct_state_probability_vector(markov_model, all_possibilities, possibility, generic_vector)
-        col_vecs.append(vec)
-    return np.column_stack(col_vecs)
+# column j of the transition matrix holds the probabilities of
+# entering each state when currently in state j
+def construct_transition_matrix(markov_model, num_states, generic_vector):
+    with instrument.stage("transition_matrix"):
+        matrix = np.repeat(generic_vector.reshape(-1, 1), num_states, axis=1)
+        for state in markov_model:
+            matrix[:, state] = construct_state_probability_vector(markov_model, num_states, state, generic_vector)
+        instrument.gauge("transition_matrix", states=num_states, observed_density=len(markov_model) / num_states)
+        return matrix
+
+# A transition matrix that stores only the columns of states observed in the
+# training data. Each of those columns is kept as a list of
+# (next state, probability) entries; every other column is the same
+# generic vector, which is stored once and shared.
+# Memory therefore grows with the number of observed transitions
+# instead of with |states|^2.
+class SparseTransitionMatrix:
+    def __init__(self, num_states, current_states, next_states, probabilities, generic_vector):
+        self.shape = (num_states, num_states)
+        self.current_states = current_states
+        self.next_states = next_states
+        self.probabilities = probabilities
+        self.generic_vector = generic_vector
+        self.observed_states = np.unique(current_states)
+        self.unobserved = np.ones(num_states, dtype=bool)
+        self.unobserved[self.observed_states] = False
+        # entries grouped by row, so that products can be summed with np.add.reduceat
+        row_order = np.argsort(next_states, kind="stable")
+        self._entry_columns = current_states[row_order]
+        self._entry_probabilities = probabilities[row_order]
+        self._rows, self._row_starts = np.unique(next_states[row_order], return_index=True)
+
+    @property
+    def nnz(self):
+        return len(self.probabilities)
+
+    # memory used by the arrays of the matrix, in bytes
+    @property
+    def nbytes(self):
+        return sum(self.memory_report().values())
+
+    # bytes used by each array of the matrix
+    def memory_report(self):
+        arrays = ["current_states", "next_states", "probabilities", "generic_vector", "observed_states",
+            "unobserved", "_entry_columns", "_entry_probabilities", "_rows", "_row_starts"]
+        return {name.lstrip("_") : getattr(self, name).nbytes for name in arrays}
+
+    # multiply the matrix with a vector, or with a matrix with one column per vector
+    def dot(self, vectors):
+        vectors = np.asarray(vectors, dtype=float)
+        weights = self._entry_probabilities.reshape((-1,) + (1,) * (vectors.ndim - 1))
+        result = np.zeros(vectors.shape)
+        if self.nnz:
+            products = weights * vectors[self._entry_columns]
+            result[self._rows] = np.add.reduceat(products, self._row_starts, axis=0)
+        # all unobserved columns are the generic vector, so together they
+        # add up to a single rank-1 term
+        unobserved_weight = vectors[self.unobserved].sum(axis=0)
+        return result + np.multiply.outer(self.generic_vector, unobserved_weight)
+
+    def column(self, state):
+        if self.unobserved[state]:
+            return self.generic_vector
+        start, end = np.searchsorted(self.current_states, [state, state + 1])
+        vec = np.zeros(self.shape[0])
+        vec[self.next_states[start:end]] = self.probabilities[start:end]
+        return vec
+
+    def toarray(self):
+        matrix = np.repeat(self.generic_vector.reshape(-1, 1), self.shape[1], axis=1)
+        matrix[:, self.observed_states] = 0
+        matrix[self.next_states, self.current_states] = self.probabilities
+        return matrix
+
+# sparse version of construct_transition_matrix
+def construct_sparse_transition_matrix(markov_model, num_states, generic_vector):
+    with instrument.stage("transition_matrix"):
+        current_states = []
+        next_states = []
+        probabilities = []
+        for state in sorted(markov_model):
+            for future in sorted(markov_model[state]):
+                current_states.append(state)
+                next_states.append(future)
+                probabilities.append(markov_model[state][future])
+        matrix = SparseTransitionMatrix(num_states, np.array(current_states, dtype=np.int64),
+            np.array(next_states, dtype=np.int64), np.array(probabilities, dtype=float), generic_vector)
+        instrument.gauge("transition_matrix", states=num_states, nnz=matrix.nnz, density=matrix.nnz / num_states ** 2)
+        return matrix
+
+# build a sparse transition matrix straight from transition pairs
+# (see count_transition_pairs), without going through the dict model
+def sparse_transition_matrix_from_pairs(pairs, num_states):
+    with instrument.stage("normalize"):
+        current_states, next_states, counts = pairs
+        state_totals = np.bincount(current_states, weights=counts, minlength=num_states)
+        generic_vector = np.bincount(next_states, weights=counts, minlength=num_states) / counts.sum()
+        probabilities = counts / state_totals[current_states]
+        matrix = SparseTransitionMatrix(num_states, current_states, next_states, probabilities, generic_vector)
+        instrument.gauge("normalize", states=num_states, states_observed=len(matrix.observed_states),
+            nnz=matrix.nnz, density=matrix.nnz / num_states ** 2)
+        return matrix
+
+# largest error of a probability rounded to float32 (half a float32 unit
+# in the last place just below 1)
+FLOAT32_ERROR = 2.0 ** -25
+
+# default largest error allowed in the probabilities of a compact matrix
+COMPACT_TOLERANCE = 1e-6
+
+# the smallest of uint16, uint32 and int64 that can hold "largest"
+def smallest_integer_type(largest):
+    for dtype in (np.uint16, np.uint32):
+        if largest <= np.iinfo(dtype).max:
+            return dtype
+    return np.int64
+
+# A transition matrix that stores the raw transition counts instead of
+# probabilities, for models with many states. Like SparseTransitionMatrix it
+# keeps only the (current state, next state) pairs that were observed, but
+# the states and counts are stored in the smallest integer types that hold
+# them (usually uint16), and the totals of each observed column and the
+# counts of the generic vector are kept instead of any float arrays.
+# Probabilities are computed from the counts when they are first needed:
+# as float32 when "tolerance", the largest error allowed in a probability,
+# is at least FLOAT32_ERROR, and as float64 otherwise. Since the counts never
+# change, the probabilities (and the entries grouped by row that dot uses,
+# like SparseTransitionMatrix) are then kept; memory_report counts them
+# once they exist. The pairs must be sorted by current state, as
+# count_transition_pairs returns them.
+class CompactTransitionMatrix:
+    def __init__(self, num_states, current_states, next_states, counts, tolerance=COMPACT_TOLERANCE):
+        self.shape = (num_states, num_states)
+        self.tolerance = tolerance
+        self.dtype = np.float32 if tolerance >= FLOAT32_ERROR else np.float64
+        state_type = smallest_integer_type(num_states - 1)
+        counts = np.asarray(counts, dtype=np.int64)
+        self.current_states = np.asarray(current_states).astype(state_type)
+        self.next_states = np.asarray(next_states).astype(state_type)
+        self.counts = counts.astype(smallest_integer_type(counts.max() if len(counts) else 0))
+        self.observed_states, column_starts = np.unique(self.current_states, return_index=True)
+        column_totals = np.add.reduceat(counts, column_starts) if len(counts) else counts
+        self.column_totals = column_totals.astype(smallest_integer_type(column_totals.max() if len(counts) else 0))
+        self._column_starts = np.append(column_starts, len(counts)).astype(smallest_integer_type(len(counts)))
+        # the generic vector is the distribution of next states over all transitions
+        self.generic_states, generic_inverse = np.unique(self.next_states, return_inverse=True)
+        generic_counts = np.bincount(generic_inverse, weights=counts, minlength=len(self.generic_states)).astype(np.int64)
+        self.generic_counts = generic_counts.astype(smallest_integer_type(generic_counts.max() if len(counts) else 0))
+        self.total = int(counts.sum())
+        self._probabilities = None
+        self._generic_probabilities = None
+        self._entry_columns = None
+        self._entry_probabilities = None
+        self._rows = None
+        self._row_starts = None
+
+    @property
+    def nnz(self):
+        return len(self.counts)
+
+    # the probability of every stored pair, computed from the counts
+    @property
+    def probabilities(self):
+        if self._probabilities is None:
+            self._probabilities = (self.counts / self._pair_totals()).astype(self.dtype)
+        return self._probabilities
+
+    @property
+    def generic_probabilities(self):
+        if self._generic_probabilities is None:
+            self._generic_probabilities = (self.generic_counts / max(self.total, 1)).astype(self.dtype)
+        return self._generic_probabilities
+
+    @property
+    def generic_vector(self):
+        vec = np.zeros(self.shape[0], dtype=self.dtype)
+        vec[self.generic_states] = self.generic_probabilities
+        return vec
+
+    # the total of the column of every stored pair
+    def _pair_totals(self):
+        return np.repeat(self.column_totals, np.diff(self._column_starts))
+
+    # the entries grouped by row, for np.add.reduceat (see SparseTransitionMatrix)
+    def _group_rows(self):
+        row_order = np.argsort(self.next_states, kind="stable")
+        self._entry_columns = self.current_states[row_order]
+        self._entry_probabilities = self.probabilities[row_order]
+        self._rows, row_starts = np.unique(self.next_states[row_order], return_index=True)
+        self._row_starts = row_starts.astype(smallest_integer_type(self.nnz))
+
+    # bytes used by each array of the matrix, including the probabilities
+    # once they have been computed
+    def memory_report(self):
+        arrays = ["current_states", "next_states", "counts", "observed_states", "column_totals",
+            "_column_starts", "generic_states", "generic_counts", "_probabilities", "_generic_probabilities",
+            "_entry_columns", "_entry_probabilities", "_rows", "_row_starts"]
+        return {name.lstrip("_") : getattr(self, name).nbytes for name in arrays if getattr(self, name) is not None}
+
+    @property
+    def nbytes(self):
+        return sum(self.memory_report().values())
+
+    # largest difference between the probabilities as computed and as exact
+    # float64 values; at most FLOAT32_ERROR when they are float32
+    def max_error(self):
+        if not self.nnz:
+            return 0.0
+        return float(np.abs(self.probabilities - self.counts / self._pair_totals()).max())
+
+    # multiply the matrix with a vector, or with a matrix with one column per vector
+    def dot(self, vectors):
+        vectors = np.asarray(vectors, dtype=float)
+        result = np.zeros(vectors.shape)
+        if self.nnz:
+            if self._rows is None:
+                self._group_rows()
+            weights = self._entry_probabilities.reshape((-1,) + (1,) * (vectors.ndim - 1))
+            products = weights * vectors[self._entry_columns]
+            result[self._rows] = np.add.reduceat(products, self._row_starts, axis=0)
+        # the unobserved columns are all the generic vector (see SparseTransitionMatrix.dot)
+        unobserved_weight = vectors.sum(axis=0) - vectors[self.observed_states].sum(axis=0)
+        result[self.generic_states] += np.multiply.outer(self.generic_probabilities, unobserved_weight)
+        return result
+
+    def column(self, state):
+        index = np.searchsorted(self.observed_states, state)
+        if index == len(self.observed_states) or self.observed_states[index] != state:
+            return self.generic_vector
+        start, end = int(self._column_starts[index]), int(self._column_starts[index + 1])
+        vec = np.zeros(self.shape[0], dtype=self.dtype)
+        vec[self.next_states[start:end]] = self.probabilities[start:end]
+        return vec
+
+    def toarray(self):
+        matrix = np.repeat(self.generic_vector.reshape(-1, 1), self.shape[1], axis=1)
+        matrix[:, self.observed_states] = 0
+        matrix[self.next_states, self.current_states] = self.probabilities
+        return matrix
+
+# build a compact transition matrix from transition pairs (see count_transition_pairs)
+def compact_transition_matrix_from_pairs(pairs, num_states, tolerance=COMPACT_TOLERANCE):
+    with instrument.stage("normalize"):
+        matrix = CompactTransitionMatrix(num_states, *pairs, tolerance=tolerance)
+        instrument.gauge("normalize", states=num_states, states_observed=len(matrix.observed_states),
+            nnz=matrix.nnz, density=matrix.nnz / num_states ** 2)
+        return matrix
+
+# a table of the bytes used by each part of a model (see WeatherModel.memory_report)
+def format_memory_report(report):
+    lines = [f"{name:<20} {size:>14,}" for name, size in report.items()]
+    lines.append(f"{'total':<20} {sum(report.values()):>14,}")
+    return "\n".join(lines)
+
+# largest error allowed when reconstructing a transition matrix from its
+# eigen-decomposition before the decomposition is considered unreliable
+EIGEN_TOLERANCE = 1e-9
+
+# models with at most this many states forecast with a dense copy of
+# their transition matrix, which lets NumPy use BLAS
+DENSE_STATE_LIMIT = 2048
+
+# hash of a training data file, stored with models so that it can be
+# told whether a model is up to date with its data
+def file_hash(file_path):
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+# Convert states given as integer codes, descriptions (see decode_state), raw
+# observations of one day (a dict) or of n_gram days (a list of dicts)
+# into the state codes of a model trained on "params" and "n_gram". Raises
+# ValueError for anything else (floats and bools included), for states
+# that do not describe n_gram days and for codes that are not states of
+# the model.
+def resolve_states(params, n_gram, states):
+    num_states = count_states(params, n_gram)
+    codes = []
+    for state in states:
+        if isinstance(state, str):
+            codes.append(encode_state_label(state, params, n_gram))
+        elif isinstance(state, (dict, list, tuple)):
+            days = [state] if isinstance(state, dict) else list(state)
+            if len(days) != n_gram or not all(isinstance(day, dict) for day in days):
+                raise ValueError(f"observations must be a list of {n_gram} dict(s), one per day, not {state!r}")
+            codes.append(encode_observations(days, params))
+        elif isinstance(state, numbers.Integral) and not isinstance(state, bool):
+            codes.append(int(state))
+        else:
+            raise ValueError(f"a state must be a state code, a description or observations, not {state!r}")
+    codes = np.array(codes, dtype=np.int64)
+    outside = (codes < 0) | (codes >= num_states)
+    if outside.any():
+        raise ValueError(f"state {codes[outside][0]} is not a state of the model (0 to {num_states - 1})")
+    return codes
+
+# a number of days as an int (NumPy integers included), which must not be negative
+def check_days(days):
+    days = operator.index(days)
+    if days < 0:
+        raise ValueError(f"days must be at least 0, not {days}")
+    return days
+
+# A trained model together with everything needed to make forecasts
+# without the training data: the transition matrix (which holds the
+# generic vector), the parameters and bin edges it was trained with,
+# and a hash of the data it was trained on.
+class WeatherModel:
+    def __init__(self, params, n_gram, transition_matrix, data_hash="", bin_edges=None, sliding=False):
+        self.params = tuple(params)
+        self.n_gram = n_gram
+        # whether the model was trained on sliding windows (see make_markov_model)
+        self.sliding = sliding
+        self.transition_matrix = transition_matrix
+        self.data_hash = data_hash
+        self.bin_edges = bin_edges if bin_edges is not None else {param : BIN_EDGES[param] for param in self.params}
+        self._clear_caches()
+
+    # caches for the long-horizon forecasters below; they must be cleared
+    # whenever the transition matrix changes
+    def _clear_caches(self):
+        self._dense_matrix = None
+        self._powers = []
+        self._eigen = None
+        self._stationary = None
+
+    @property
+    def num_states(self):
+        return self.transition_matrix.shape[0]
+
+    @property
+    def generic_vector(self):
+        return self.transition_matrix.generic_vector
+
+    # memory used by the model, including the caches of the forecasters
+    @property
+    def nbytes(self):
+        return sum(self.memory_report().values())
+
+    # bytes used by each array of the transition matrix and by each cache
+    # of the forecasters (see format_memory_report)
+    def memory_report(self):
+        report = self.transition_matrix.memory_report()
+        # the first power is the dense matrix itself
+        powers = self._powers[1:] if self._powers and self._dense_matrix is self._powers[0] else self._powers
+        caches = {"dense_matrix" : [self._dense_matrix], "powers" : powers,
+            "eigen" : list(self._eigen or []), "stationary" : [self._stationary]}
+        for name, arrays in caches.items():
+            report[name] = sum(array.nbytes for array in arrays if array is not None)
+        return report
+
+    # probabilities of all states on the day after "state"
+    def state_probability_vector(self, state):
+        return self.transition_matrix.column(state)
+
+    def dense_matrix(self):
+        if self._dense_matrix is None:
+            with instrument.stage("transition_matrix"):
+                self._dense_matrix = self.transition_matrix.toarray()
+        return self._dense_matrix
+
+    # transition_matrix^(2^k), computed by repeated squaring
+    def _power_of_two(self, k):
+        if not self._powers:
+            self._powers.append(self.dense_matrix())
+        while len(self._powers) <= k:
+            self._powers.append(self._powers[-1] @ self._powers[-1])
+        return self._powers[k]
+
+    # transition_matrix^days in O(log days) matrix products
+    def matrix_power(self, days):
+        days = check_days(days)
+        result = np.identity(self.num_states)
+        for k in range(days.bit_length()):
+            if days >> k & 1:
+                result = self._power_of_two(k) @ result
+        return result
+
+    # transition_matrix = V diag(eigenvalues) V^-1, or None if the matrix is
+    # too close to defective for the decomposition to be trusted
+    def _eigen_decomposition(self):
+        if self._eigen is None:
+            matrix = self.dense_matrix()
+            eigenvalues, eigenvectors = np.linalg.eig(matrix)
+            try:
+                inverse = np.linalg.inv(eigenvectors)
+            except np.linalg.LinAlgError:
+                inverse = None
+            if inverse is not None:
+                reconstructed = (eigenvectors * eigenvalues) @ inverse
+                if np.abs(reconstructed - matrix).max() > EIGEN_TOLERANCE:
+                    inverse = None
+            self._eigen = (eigenvalues, eigenvectors, inverse)
+        if self._eigen[2] is None:
+            return None
+        return self._eigen
+
+    # Probabilities of all states "days" days after the distribution
+    # "state_prob_vector". Methods:
+    # "steps": one sparse product per day
+    # "power": O(log days) products with cached powers of the matrix
+    # "eigen": O(1) products with a cached eigen-decomposition (falls back
+    #          to "power" if the matrix cannot be diagonalized reliably)
+    def forecast_distribution(self, state_prob_vector, days, method="power"):
+        days = check_days(days)
+        with instrument.stage("forecast"):
+            instrument.count("forecast", forecasts=1, steps=days)
+            return self._forecast_distribution(state_prob_vector, days, method)
+
+    def _forecast_distribution(self, state_prob_vector, days, method):
+        vec = np.asarray(state_prob_vector, dtype=float)
+        if method == "eigen":
+            eigen = self._eigen_decomposition()
+            if eigen is not None:
+                eigenvalues, eigenvectors, inverse = eigen
+                return (eigenvectors @ (eigenvalues ** days * (inverse @ vec))).real
+            method = "power"
+        if method == "power":
+            for k in range(days.bit_length()):
+                if days >> k & 1:
+                    vec = self._power_of_two(k) @ vec
+            return vec
+        if method == "steps":
+            for _ in range(days):
+                vec = self.transition_matrix.dot(vec)
+            return vec
+        raise ValueError(f"unknown forecast method: {method}")
+
+    # state codes of states given in any form the function resolve_states accepts
+    def resolve_states(self, states):
+        return resolve_states(self.params, self.n_gram, states)
+
+    # The function that moves vectors of state probabilities (or a matrix
+    # with one column per vector) one step ahead, and the dtype the vectors
+    # should have. Models with at most DENSE_STATE_LIMIT states use their
+    # dense matrix, which lets NumPy use BLAS; its dtype is float32 for
+    # compact matrices, so the matrix is not converted on every step.
+    def step_function(self):
+        if self.num_states <= DENSE_STATE_LIMIT:
+            return self.dense_matrix().__matmul__, self.dense_matrix().dtype
+        return self.transition_matrix.dot, np.float64
+
+    # Forecast many initial states at once. Returns an array of shape
+    # (len(initial_states), horizon, num_states) whose [i, d] row holds the
+    # probabilities of every state d+1 days after initial_states[i].
+    # Each day is a single matrix-matrix product over the whole batch.
+    def forecast(self, initial_states, horizon):
+        codes = self.resolve_states(initial_states)
+        step, dtype = self.step_function()
+        with instrument.stage("forecast"):
+            vectors = np.zeros((self.num_states, len(codes)), dtype=dtype)
+            vectors[codes, np.arange(len(codes))] = 1
+            forecasts = np.empty((len(codes), horizon, self.num_states))
+            for day in range(horizon):
+                vectors = step(vectors)
+                forecasts[:, day] = vectors.T
+            instrument.count("forecast", forecasts=len(codes), steps=horizon)
+        return forecasts
+
+    # the long-run distribution pi with transition_matrix @ pi = pi
+    def stationary_distribution(self):
+        if self._stationary is None:
+            matrix = self.dense_matrix()
+            # (T - I) pi = 0 together with sum(pi) = 1
+            system = np.vstack([matrix - np.identity(self.num_states), np.ones(self.num_states)])
+            target = np.zeros(self.num_states + 1)
+            target[-1] = 1
+            stationary = np.linalg.lstsq(system, target, rcond=None)[0]
+            stationary = np.clip(stationary, 0, None)
+            self._stationary = stationary / stationary.sum()
+        return self._stationary
+
+# with compact=True the model keeps a CompactTransitionMatrix, whose
+# probabilities are within "tolerance" of the exact ones
+def train_weather_model(file_path, params, n_gram, sliding=False, compact=False, tolerance=COMPACT_TOLERANCE):
+    pairs = make_transition_counts(file_path, params, n_gram, sparse=True, sliding=sliding)
+    if compact:
+        transition_matrix = compact_transition_matrix_from_pairs(pairs, count_states(params, n_gram), tolerance)
+    else:
+        transition_matrix = sparse_transition_matrix_from_pairs(pairs, count_states(params, n_gram))
+    return WeatherModel(params, n_gram, transition_matrix, file_hash(file_path), sliding=sliding)
+
+# A model that can be updated with new days of data without retraining.
+# It keeps the raw transition counts (as built by insert_into_markov_model)
+# and, after each update, recomputes only the columns of markov_model and
+# the stored columns of the transition matrix whose counts changed; the
+# counts of the generic vector, which is shared by all unobserved columns,
+# are updated in place. So adding a day costs time in proportion to the
+# columns it changes, not to the size of the model. Using the model after
+# an update does cost time in proportion to its size, once: the transition
+# matrix is then rebuilt in full from the stored columns (re-sorting all
+# entries by row), and the caches of the forecasters, the dense matrix
+# included, are recomputed when next needed, since the generic vector of
+# every unobserved column changes with each new transition. Adding many
+# days with one add_* call therefore pays this cost once. The result is
+# exactly the model a full retrain on the same rows gives.
+class IncrementalMarkovModel(WeatherModel):
+    def __init__(self, params, n_gram, sliding=False):
+        num_states = count_states(params, n_gram)
+        no_states = np.zeros(0, dtype=np.int64)
+        transition_matrix = SparseTransitionMatrix(num_states, no_states, no_states, np.zeros(0), np.zeros(num_states))
+        super().__init__(params, n_gram, transition_matrix, sliding=sliding)
+        self.raw_frequencies = {}
+        self.markov_model = {}
+        # number of transitions into each state, and in total
+        self._future_counts = np.zeros(num_states, dtype=np.int64)
+        self._total = 0
+        # sparse columns of the transition matrix: state -> (next states, probabilities)
+        self._columns = {}
+        if sliding:
+            self._transitions = SlidingTransitionReader(count_states(params), n_gram)
+        else:
+            self._transitions = BlockTransitionReader(count_states(params), n_gram)
+        # skip first line, like make_markov_model
+        self._skip_next_row = not sliding
+
+    # the transition matrix, rebuilt in full from the stored columns if
+    # they changed since it was last used
+    @property
+    def transition_matrix(self):
+        if self._transition_matrix is None:
+            self._transition_matrix = self._assemble()
+        return self._transition_matrix
+
+    @transition_matrix.setter
+    def transition_matrix(self, transition_matrix):
+        self._transition_matrix = transition_matrix
+
+    # same as the generic model of make_markov_model
+    @property
+    def generic_probabilities(self):
+        futures = np.flatnonzero(self._future_counts)
+        return {future : count / self._total for future, count in zip(futures.tolist(), self._future_counts[futures].tolist())}
+
+    # add one day of data, e.g. a row of csv.DictReader
+    def add_row(self, row):
+        self.add_rows([row])
+
+    def add_rows(self, rows):
+        day_states = []
+        for row in rows:
+            day_states.append(encode_weather_info((param, row.get(param)) for param in self.params))
+        self.add_day_states(day_states)
+
+    # add many days at once, given as an array of values such as those
+    # returned by load_weather_columns
+    def add_values(self, values):
+        self.add_day_states(classify_weather_columns(values, self.params).tolist())
+
+    def add_day_states(self, day_states):
+        changed_states = set()
+        for day_state in day_states:
+            if self._skip_next_row:
+                self._skip_next_row = False
+                continue
+            transition = self._transitions.add(day_state)
+            if transition is not None:
+                insert_into_markov_model(self.raw_frequencies, *transition)
+                current_state, next_state = transition
+                self._future_counts[next_state] += 1
+                self._total += 1
+                changed_states.add(current_state)
+        if changed_states:
+            self._refresh(changed_states)
+
+    def _refresh(self, changed_states):
+        for state in changed_states:
+            futures = self.raw_frequencies[state]
+            sub_total = sum(futures.values())
+            self.markov_model[state] = {future : count / sub_total for future, count in futures.items()}
+            next_states = np.array(sorted(futures), dtype=np.int64)
+            counts = np.array([futures[future] for future in next_states.tolist()])
+            self._columns[state] = (next_states, counts / sub_total)
+        self._transition_matrix = None
+        self._clear_caches()
+
+    def _assemble(self):
+        generic_vector = self._future_counts / max(self._total, 1)
+        states = sorted(self._columns)
+        current_states = np.repeat(np.array(states, dtype=np.int64), [len(self._columns[state][0]) for state in states])
+        next_states = np.concatenate([self._columns[state][0] for state in states] or [np.zeros(0, dtype=np.int64)])
+        probabilities = np.concatenate([self._columns[state][1] for state in states] or [np.zeros(0)])
+        return SparseTransitionMatrix(len(generic_vector), current_states, next_states, probabilities, generic_vector)
+
+# models are saved as uncompressed .npz files, which load in milliseconds;
+# those with a CompactTransitionMatrix are saved as their counts, in the
+# same small integer types as in memory
+def save_markov_model(model, file_path=None):
+    if file_path is None:
+        file_path = f"data/pre_built_models/model_created_on_{date.today()}_{datetime.now().time()}.npz"
+    matrix = model.transition_matrix
+    if isinstance(matrix, CompactTransitionMatrix):
+        arrays = {"counts" : matrix.counts, "tolerance" : np.array(matrix.tolerance)}
+    else:
+        arrays = {"probabilities" : matrix.probabilities, "generic_vector" : matrix.generic_vector}
+    np.savez(
+        file_path,
+        params=np.array(model.params),
+        n_gram=np.array(model.n_gram),
+        sliding=np.array(model.sliding),
+        bin_edges=np.concatenate([np.asarray(model.bin_edges[param], dtype=float) for param in model.params]),
+        bin_edge_counts=np.array([len(model.bin_edges[param]) for param in model.params]),
+        data_hash=np.array(model.data_hash),
+        current_states=matrix.current_states,
+        next_states=matrix.next_states,
+        **arrays
+    )
+
+def load_markov_model(file_path):
+    with np.load(file_path, allow_pickle=False) as f:
+        params = tuple(f["params"].tolist())
+        n_gram = int(f["n_gram"])
+        sliding = bool(f["sliding"]) if "sliding" in f else False
+        edges = np.split(f["bin_edges"], np.cumsum(f["bin_edge_counts"])[:-1])
+        bin_edges = {param : tuple(param_edges.tolist()) for param, param_edges in zip(params, edges)}
+        for param in params:
+            if bin_edges[param] != tuple(float(edge) for edge in BIN_EDGES[param]):
+                raise ValueError(f"{file_path} was trained with different bin edges for {param}: {bin_edges[param]}")
+        if "counts" in f:
+            transition_matrix = CompactTransitionMatrix(count_states(params, n_gram), f["current_states"],
+                f["next_states"], f["counts"], float(f["tolerance"]))
+        else:
+            transition_matrix = SparseTransitionMatrix(count_states(params, n_gram), f["current_states"],
+                f["next_states"], f["probabilities"], f["generic_vector"])
+        return WeatherModel(params, n_gram, transition_matrix, str(f["data_hash"]), bin_edges, sliding)
 
 if __name__ == "__main__":
     params = ["tavg", "tmax", "tmin", "prcp", "wspd"]
-    model, generic_model = make_markov_model("data/san_jose_weather.csv", params, 1)
-    
-    all_possibilities = construct_states_vector_template(params)
-    generic_vector = construct_generic_probability_vector(generic_model, all_possibilities)
-    transition_matrix = construct_transition_matrix(model, all_possibilities, generic_vector)
-    column_sums = np.sum(transition_matrix, axis=0)
-    # print(column_sums)
-    # print(np.sum(generic_model))
-
-    # import random
-    # random_curr = model[random.choice(list(model.keys()))]
-    # random_state = random_curr[random.choice(list(random_curr.keys()))]
-    # print(sum([val for key, val in random_curr.items()]))
-    # statevec = construct_state_probability_vector(model, all_possibilities, random_state, generic_vector)
-    # print(sum(statevec))
-    
+    model = train_weather_model("data/san_jose_weather.csv", params, 1)
     save_markov_model(model)
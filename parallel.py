@@ -0,0 +1,141 @@
+import hashlib
+import os
+from concurrent.futures import ProcessPoolExecutor
+from csv import reader
+import numpy as np
+import markov
+import ingest
+
+# Parallel training. Work is split by input file and, for plain csv files,
+# further into shards of consecutive lines. Since rows are in date order,
+# each shard covers a range of dates. Every worker returns partial
+# transition counts, which are added up before normalizing.
+#
+# Transitions that cross a shard boundary are handled as follows: a block
+# (see markov.count_transitions) belongs to the shard it starts in, and a
+# worker reads the 2 * n_gram lines after its shard to finish its last
+# blocks. Where blocks start depends on how many days came before the shard,
+# so the days of every shard are first counted (by counting non-empty lines,
+# which is much faster than parsing them), and each worker is then told how
+# many days to skip before its first block. Sliding windows start on every
+# day, so for them a worker only needs the 2 * n_gram - 1 lines after its
+# shard. The result is identical to training on each file serially.
+
+# split the lines of a file (after its header) into about "num_shards"
+# byte ranges, each starting at the beginning of a line
+def find_shards(file_path, num_shards):
+    size = os.path.getsize(file_path)
+    with open(file_path, 'rb') as f:
+        f.readline()
+        header_end = f.tell()
+        boundaries = [header_end]
+        for i in range(1, num_shards):
+            f.seek(header_end + (size - header_end) * i // num_shards)
+            f.readline()
+            if f.tell() > boundaries[-1] and f.tell() < size:
+                boundaries.append(f.tell())
+    boundaries.append(size)
+    return list(zip(boundaries[:-1], boundaries[1:]))
+
+# only uncompressed files whose numbers are plain ascii can be split by bytes
+def can_split(file_path):
+    with open(file_path, 'rb') as f:
+        start = f.read(1 << 16)
+    return not start.startswith(b"\x1f\x8b") and ingest.detect_encoding(start) in ("utf-8", "utf-8-sig", "latin-1")
+
+def read_range(file_path, start, end, chunk_bytes=ingest.CHUNK_BYTES):
+    with open(file_path, 'rb') as f:
+        f.seek(start)
+        while f.tell() < end:
+            data = f.read(min(chunk_bytes, end - f.tell()))
+            if f.tell() < end:
+                # read on to the end of the last line
+                data += f.readline()
+            yield data
+
+# the state codes of the first "num_days" days starting at byte "start"
+def read_days_after(file_path, start, columns, params, num_days):
+    day_states = []
+    with open(file_path, 'rb') as f:
+        f.seek(start)
+        while len(day_states) < num_days:
+            line = f.readline()
+            if not line:
+                break
+            values = markov.parse_weather_lines(line, columns)
+            day_states.extend(markov.classify_weather_columns(values, params).tolist())
+    return np.array(day_states[:num_days], dtype=np.int64)
+
+# Worker: the number of days in a byte range of a file: its lines, except
+# empty ones (which may hold a carriage return), which the parser skips
+def count_days(file_path, start, end):
+    days = 0
+    for data in read_range(file_path, start, end):
+        data = np.frombuffer(data, dtype=np.uint8)
+        newlines = np.flatnonzero(data == ord("\n"))
+        line_starts = np.append(0, newlines + 1)
+        line_lengths = np.append(newlines, len(data)) - line_starts
+        single = line_lengths == 1
+        days += int(np.count_nonzero(line_lengths > 1))
+        days += int(np.count_nonzero(data[line_starts[single]] != ord("\r")))
+    return days
+
+# Worker: count the transitions of the blocks (or windows) starting in one
+# shard, skipping its first "skip_days" days, which belong to a block that
+# started in the shard before.
+def count_shard(file_path, start, end, params, n_gram, sliding=False, skip_days=0):
+    with open(file_path, 'r', encoding='utf-8', errors='replace') as f:
+        columns = ingest.find_columns(next(reader(f)), params)
+    counter = markov.TransitionCounter(markov.count_states(params), n_gram, skip_days, sliding)
+    for data in read_range(file_path, start, end):
+        counter.add(markov.classify_weather_columns(markov.parse_weather_lines(data, columns), params))
+    counter.add(read_days_after(file_path, end, columns, params, 2 * n_gram - sliding))
+    return counter.pairs
+
+# Worker: count the transitions of a whole file that cannot be split.
+def count_file(file_path, params, n_gram, sliding=False):
+    chunks = ingest.read_weather_chunks(file_path, params)
+    return ingest.count_chunks(ingest.classify_chunks(chunks, params), params, n_gram, sliding)
+
+# a single hash for several data files
+def files_hash(file_paths):
+    if len(file_paths) == 1:
+        return markov.file_hash(file_paths[0])
+    digest = hashlib.sha256()
+    for file_path in file_paths:
+        digest.update(markov.file_hash(file_path).encode())
+    return digest.hexdigest()
+
+# Train one model on several csv files using a pool of "workers" processes.
+# Each file is read as its own sequence of days, so the counts are those of
+# training on each file separately, added up. Files are split into about
+# "shards_per_file" shards (by default enough to keep every worker busy).
+def train_weather_model(file_paths, params, n_gram, sliding=False, workers=None, shards_per_file=None):
+    if isinstance(file_paths, str):
+        file_paths = [file_paths]
+    workers = workers or os.cpu_count() or 1
+    if shards_per_file is None:
+        shards_per_file = max(1, -(-workers // len(file_paths)))
+    block = 2 * n_gram + 1
+    with ProcessPoolExecutor(workers) as pool:
+        shards = {file_path : find_shards(file_path, shards_per_file) for file_path in file_paths if can_split(file_path)}
+        if not sliding:
+            day_counts = {file_path : [pool.submit(count_days, file_path, start, end) for start, end in file_shards]
+                for file_path, file_shards in shards.items()}
+        jobs = []
+        for file_path in file_paths:
+            if file_path not in shards:
+                jobs.append(pool.submit(count_file, file_path, params, n_gram, sliding))
+                continue
+            days_before = 0
+            for i, (start, end) in enumerate(shards[file_path]):
+                # blocks start after the first day of the file, every "block" days
+                skip_days = 0 if sliding else (1 - days_before) % block
+                jobs.append(pool.submit(count_shard, file_path, start, end, params, n_gram, sliding, skip_days))
+                if not sliding:
+                    days_before += day_counts[file_path][i].result()
+        pairs_list = [job.result() for job in jobs]
+    num_ngram_states = markov.count_states(params, n_gram)
+    pairs = markov.merge_transition_pairs(pairs_list, num_ngram_states)
+    transition_matrix = markov.sparse_transition_matrix_from_pairs(pairs, num_ngram_states)
+    return markov.WeatherModel(params, n_gram, transition_matrix, files_hash(file_paths), sliding=sliding)
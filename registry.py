@@ -0,0 +1,148 @@
+import json
+import os
+
+# An index of the saved models in a directory (by default
+# data/pre_built_models), so that they can be listed and picked without
+# loading any of them, and without importing numpy.
+#
+# The index is kept in a manifest file in the same directory, with one
+# entry per .npz file: its name, params, n_gram, whether it was trained on
+# sliding windows, its number of states, file size, modification time and
+# the hash of its training data. Listing the models only compares the
+# sizes and modification times of the files with the manifest; files that
+# are new or changed are read (which needs numpy) and the manifest is
+# rewritten. So a model saved into the directory shows up without any
+# change to the code. Models themselves are loaded on first use.
+
+PRE_BUILT_DIRECTORY = "data/pre_built_models"
+MANIFEST_FILE = "manifest.json"
+
+# parameters in the order of markov.PARAM_RANGES, used to sort the models
+PARAM_ORDER = ["tavg", "tmin", "tmax", "prcp", "wspd"]
+
+class ModelRegistry:
+    def __init__(self, directory=PRE_BUILT_DIRECTORY):
+        self.directory = directory
+        self.manifest_path = os.path.join(directory, MANIFEST_FILE)
+        self._entries = None
+        # loaded models: name -> ((size, modification time), model)
+        self._models = {}
+
+    # the entries of all usable models, fewest params first
+    def entries(self):
+        files = self._scan_files()
+        if self._entries is None:
+            self._entries = self._read_manifest()
+        known = {entry["file"] : entry for entry in self._entries}
+        if {name : (stat.st_size, stat.st_mtime_ns) for name, stat in files.items()} != \
+                {name : (entry["size"], entry["mtime_ns"]) for name, entry in known.items()}:
+            self._entries = self.refresh(files, known)
+        return [entry for entry in self._entries if "error" not in entry]
+
+    # re-read the files that are new or changed and rewrite the manifest
+    def refresh(self, files=None, known=None):
+        files = self._scan_files() if files is None else files
+        known = known or {}
+        entries = []
+        for name, stat in files.items():
+            entry = known.get(name)
+            if entry is None or (entry["size"], entry["mtime_ns"]) != (stat.st_size, stat.st_mtime_ns):
+                entry = read_entry(os.path.join(self.directory, name), stat)
+            entries.append(entry)
+        entries.sort(key=entry_order)
+        temporary_path = self.manifest_path + ".tmp"
+        try:
+            with open(temporary_path, 'w') as f:
+                json.dump({"models" : entries}, f, indent=1)
+            os.replace(temporary_path, self.manifest_path)
+        except OSError:
+            # a read-only directory can still be listed, just not indexed
+            pass
+        return entries
+
+    def find(self, params, n_gram=1, sliding=False):
+        for entry in self.entries():
+            if entry["params"] == list(params) and entry["n_gram"] == n_gram and entry["sliding"] == sliding:
+                return entry
+        return None
+
+    def get_entry(self, name):
+        for entry in self.entries():
+            if entry["name"] == name:
+                return entry
+        raise KeyError(f"no model named {name} in {self.directory}")
+
+    def path(self, entry):
+        return os.path.join(self.directory, entry["file"])
+
+    # the model of an entry (or of an entry's name), loaded on first use
+    # and again whenever its file changes
+    def load(self, entry):
+        if isinstance(entry, str):
+            entry = self.get_entry(entry)
+        signature = (entry["size"], entry["mtime_ns"])
+        cached = self._models.get(entry["name"])
+        if cached is None or cached[0] != signature:
+            import markov
+            cached = (signature, markov.load_markov_model(self.path(entry)))
+            self._models[entry["name"]] = cached
+        return cached[1]
+
+    def _scan_files(self):
+        files = {}
+        try:
+            with os.scandir(self.directory) as scan:
+                for item in scan:
+                    if item.name.endswith(".npz") and item.is_file():
+                        files[item.name] = item.stat()
+        except FileNotFoundError:
+            pass
+        return files
+
+    def _read_manifest(self):
+        try:
+            with open(self.manifest_path) as f:
+                return json.load(f)["models"]
+        except (OSError, ValueError, KeyError):
+            return []
+
+# the manifest entry of a model file; files that cannot be read as models
+# get an entry with an "error", so they are not read again until they change
+def read_entry(file_path, stat):
+    import numpy as np
+    import markov
+    entry = {"name" : os.path.basename(file_path)[:-len(".npz")], "file" : os.path.basename(file_path),
+        "size" : stat.st_size, "mtime_ns" : stat.st_mtime_ns}
+    try:
+        with np.load(file_path, allow_pickle=False) as f:
+            params = f["params"].tolist()
+            entry["params"] = params
+            entry["n_gram"] = int(f["n_gram"])
+            entry["sliding"] = bool(f["sliding"]) if "sliding" in f else False
+            entry["num_states"] = markov.count_states(params, entry["n_gram"])
+            entry["data_hash"] = str(f["data_hash"])
+    except Exception as error:
+        entry["error"] = f"{type(error).__name__}: {error}"
+    return entry
+
+def entry_order(entry):
+    if "error" in entry:
+        return (1, entry["name"])
+    params = [PARAM_ORDER.index(param) if param in PARAM_ORDER else len(PARAM_ORDER) for param in entry["params"]]
+    return (0, len(params), entry["n_gram"], entry["sliding"], params, entry["name"])
+
+# e.g. 'trained on "tavg", "tmax", and "prcp"'
+def describe(entry):
+    names = [f'"{param}"' for param in entry["params"]]
+    if len(names) == 1:
+        text = names[0]
+    elif len(names) == 2:
+        text = f"{names[0]} and {names[1]}"
+    else:
+        text = ", ".join(names[:-1]) + ", and " + names[-1]
+    extras = []
+    if entry["n_gram"] != 1:
+        extras.append(f"{entry['n_gram']}-day states")
+    if entry["sliding"]:
+        extras.append("sliding windows")
+    return f"trained on {text}" + (f" ({', '.join(extras)})" if extras else "")
@@ -0,0 +1,166 @@
+from csv import reader
+import numpy as np
+import markov
+import ingest
+
+# Season-dependent models. Weather in January follows different transitions
+# than weather in July, so instead of one transition matrix for the whole
+# year, a model bank holds one per season, each a sparse transition matrix
+# like the model of the whole year. A season is either a calendar
+# month or a window of window_days days around one of num_seasons evenly
+# spaced days of the year (windows may overlap, so every transition counts
+# towards each window it falls in).
+#
+# Dates are placed on a 366-day calendar (a leap year), so that the same
+# month and day always get the same calendar day. The season of each
+# calendar day is kept in a table, which makes finding the matrix of any
+# date a single lookup.
+
+CALENDAR_DAYS = 366
+# calendar day of the first of each month
+MONTH_STARTS = np.cumsum([0, 31, 29, 31, 30, 31, 30, 31, 31, 30, 31, 30])
+
+# the calendar day (0 to 365) of each date (a string, date or np.datetime64, or an array of them)
+def calendar_day(dates):
+    dates = np.asarray(dates, dtype="datetime64[D]")
+    months = dates.astype("datetime64[M]")
+    return MONTH_STARTS[months.astype(np.int64) % 12] + (dates - months).astype(np.int64)
+
+# Which calendar days belong to which season. Returns (membership,
+# day_seasons): membership[c, s] says whether calendar day c counts
+# towards season s when training, and day_seasons[c] is the season whose
+# matrix is used on calendar day c when forecasting.
+def make_seasons(num_seasons=None, window_days=None):
+    days = np.arange(CALENDAR_DAYS)
+    if num_seasons is None:
+        # calendar months
+        day_seasons = np.searchsorted(MONTH_STARTS, days, side="right") - 1
+        return day_seasons.reshape(-1, 1) == np.arange(12), day_seasons
+    centers = np.arange(num_seasons) * CALENDAR_DAYS // num_seasons
+    distances = np.abs(days.reshape(-1, 1) - centers)
+    distances = np.minimum(distances, CALENDAR_DAYS - distances)
+    if window_days is None:
+        window_days = -(-CALENDAR_DAYS // num_seasons)
+    return 2 * distances <= window_days, np.argmin(distances, axis=1)
+
+# the dates of all rows of a csv file
+def load_weather_dates(file_path):
+    with open(file_path, 'r', encoding='utf-8', errors='replace') as csv_file:
+        column = ingest.find_columns(next(reader(csv_file)), ["date"])[0]
+        dates = [row[column] for row in reader(csv_file) if row]
+    return np.array(dates, dtype="datetime64[D]")
+
+# the day on which each transition of find_transitions enters its next state
+def transition_days(num_days, n_gram, sliding=False):
+    if sliding:
+        return np.arange(max(0, num_days - 2 * n_gram + 1)) + n_gram
+    block = 2 * n_gram + 1
+    # the first day is skipped, like make_markov_model
+    return 1 + np.arange((num_days - 1) // block) * block + n_gram
+
+# A WeatherModel whose transitions depend on the date. transition_matrix
+# still holds the model of the whole year, so everything a WeatherModel can
+# do works as before; matrices[s] is the SparseTransitionMatrix of season
+# s, and day_seasons maps each calendar day to its season.
+class SeasonalModelBank(markov.WeatherModel):
+    def __init__(self, params, n_gram, transition_matrix, matrices, day_seasons, data_hash="", bin_edges=None, sliding=False):
+        super().__init__(params, n_gram, transition_matrix, data_hash, bin_edges, sliding)
+        self.matrices = matrices
+        self.day_seasons = day_seasons
+
+    @property
+    def num_seasons(self):
+        return len(self.matrices)
+
+    def memory_report(self):
+        report = super().memory_report()
+        report["seasonal_matrices"] = sum(matrix.nbytes for matrix in self.matrices)
+        report["day_seasons"] = self.day_seasons.nbytes
+        return report
+
+    def season(self, date):
+        return self.day_seasons[calendar_day(date)]
+
+    # the transition matrix that leads into the given date
+    def matrix_for(self, date):
+        return self.matrices[self.season(date)]
+
+    # the dates on which the first "steps" steps after start_date enter
+    # their next state; each step covers n_gram days
+    def step_dates(self, start_date, steps):
+        return np.datetime64(start_date, "D") + 1 + np.arange(steps) * self.n_gram
+
+    # Forecast many initial states, whose last day is "start_date". Returns
+    # an array of shape (len(initial_states), horizon, num_states) like
+    # WeatherModel.forecast, except that each step uses the matrix of the
+    # season of the day it starts on. Without a date, the model of the whole
+    # year is used.
+    def forecast(self, initial_states, horizon, start_date=None):
+        if start_date is None:
+            return super().forecast(initial_states, horizon)
+        codes = self.resolve_states(initial_states)
+        seasons = self.season(self.step_dates(start_date, horizon))
+        vectors = np.zeros((self.num_states, len(codes)))
+        vectors[codes, np.arange(len(codes))] = 1
+        forecasts = np.empty((len(codes), horizon, self.num_states))
+        for step in range(horizon):
+            vectors = self.matrices[seasons[step]].dot(vectors)
+            forecasts[:, step] = vectors.T
+        return forecasts
+
+    # the probabilities of all states "days" steps after start_date,
+    # starting from the distribution "vec"
+    def forecast_distribution(self, vec, days, method="power", start_date=None):
+        days = markov.check_days(days)
+        if start_date is None:
+            return super().forecast_distribution(vec, days, method)
+        for season in self.season(self.step_dates(start_date, days)):
+            vec = self.matrices[season].dot(vec)
+        return vec
+
+# One transition matrix per season from the transitions of each season,
+# given as transition pairs keyed by season. Like the model of the whole
+# year, a column that was never observed in a season gets that season's
+# generic vector; a season without any data gets the generic vector of the
+# whole year.
+def seasonal_matrices_from_pairs(seasons, current_states, next_states, counts, num_seasons, num_states, generic_vector):
+    matrices = []
+    starts = np.searchsorted(seasons, np.arange(num_seasons + 1))
+    for season in range(num_seasons):
+        start, end = starts[season], starts[season + 1]
+        if start == end:
+            no_states = np.zeros(0, dtype=np.int64)
+            matrices.append(markov.SparseTransitionMatrix(num_states, no_states, no_states, np.zeros(0), generic_vector))
+            continue
+        pairs = (current_states[start:end], next_states[start:end], counts[start:end])
+        matrices.append(markov.sparse_transition_matrix_from_pairs(pairs, num_states))
+    return matrices
+
+# Build a model bank from day states and their dates in a single pass over
+# the transitions: each transition is counted towards every season its
+# date belongs to, as sparse pairs sorted by season, with one np.unique.
+def build_seasonal_model(day_states, dates, params, n_gram, num_seasons=None, window_days=None, sliding=False):
+    num_day_states = markov.count_states(params)
+    num_states = markov.count_states(params, n_gram)
+    membership, day_seasons = make_seasons(num_seasons, window_days)
+    day_states = np.asarray(day_states, dtype=np.int64)
+    transition_states = day_states if sliding else day_states[1:]
+    current_states, next_states = markov.find_transitions(transition_states, num_day_states, n_gram, sliding)
+    transitions, seasons = np.nonzero(membership[calendar_day(dates[transition_days(len(day_states), n_gram, sliding)])])
+    keys = (seasons * num_states + current_states[transitions]) * num_states + next_states[transitions]
+    keys, counts = np.unique(keys, return_counts=True)
+    season_keys, next_keys = np.divmod(keys, num_states)
+    pair_seasons, pair_currents = np.divmod(season_keys, num_states)
+    pairs = markov.make_transition_pairs(current_states, next_states, num_states)
+    transition_matrix = markov.sparse_transition_matrix_from_pairs(pairs, num_states)
+    matrices = seasonal_matrices_from_pairs(pair_seasons, pair_currents, next_keys, counts,
+        membership.shape[1], num_states, transition_matrix.generic_vector)
+    return SeasonalModelBank(params, n_gram, transition_matrix, matrices, day_seasons, sliding=sliding)
+
+# Train a model bank on a csv file. By default there is one season per
+# month; with num_seasons, seasons are windows of window_days days.
+def train_seasonal_model(file_path, params, n_gram, num_seasons=None, window_days=None, sliding=False):
+    day_states = markov.classify_weather_columns(markov.load_weather_columns(file_path, params), params)
+    model = build_seasonal_model(day_states, load_weather_dates(file_path), params, n_gram, num_seasons, window_days, sliding)
+    model.data_hash = markov.file_hash(file_path)
+    return model
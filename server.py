@@ -0,0 +1,270 @@
+import argparse
+import asyncio
+import json
+import os
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+import markov
+import batch
+
+# A local forecast service. Models stay loaded between requests, and
+# requests are answered over HTTP (on a TCP port or a unix socket):
+#   POST /forecast   body: a query (see batch.py) or a list of queries;
+#                    answer: the answer or a list of answers
+#   GET /models      the models that are loaded
+#   GET /health      {"status": "ok"}
+#
+# Concurrent requests are coalesced: queries that arrive while a batch is
+# being computed wait for it to finish and are then answered together with
+# batch.answer_queries, which makes one batched matrix product per model and
+# horizon. Batches are computed on a worker thread, so the event loop keeps
+# accepting and parsing requests meanwhile, and the more clients there are,
+# the larger (not the slower) the batches get.
+#
+# Over HTTP, the "model" of a query (see batch.py) is the name of a model
+# in data/pre_built_models (see registry.py), never a path, so clients can
+# only make the server read the files of that directory. A request that is
+# not valid HTTP is answered with 400, and one whose body is larger than
+# MAX_BODY_BYTES with 413, before the connection is closed.
+#
+# Model files (those in data/pre_built_models) are checked
+# every RELOAD_SECONDS. A changed file is loaded in the background and then
+# swapped in with a single assignment: requests already being answered
+# finish with the old model, later ones use the new one. A file that
+# cannot be loaded (e.g. because it is still being written; write to a
+# temporary file and os.replace it instead) is tried again later, and the
+# old model is kept meanwhile.
+
+RELOAD_SECONDS = 1.0
+MAX_BODY_BYTES = 16 << 20
+
+# a batch.ModelStore that remembers which file each model came from, so
+# that it can be reloaded when the file changes, and that only loads files
+# of the registry
+class ReloadingModelStore(batch.ModelStore):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # model key -> (file path, (size, modification time)) of the file it was loaded from
+        self.files = {}
+        self.reloads = 0
+
+    # a "model" is looked up by name in the registry, so that no other file can be opened
+    def source_file(self, key):
+        if key[0] == "model":
+            if not isinstance(key[1], str):
+                raise ValueError(f"model must be the name of a model, not {key[1]!r}")
+            return self.registry.path(self.registry.get_entry(key[1]))
+        return super().source_file(key)
+
+    def load(self, key):
+        file_path = self.source_file(key)
+        if file_path is None:
+            return super().load(key)
+        signature = file_signature(file_path)
+        model = super().load(key)
+        self.files[key] = (file_path, signature)
+        return model
+
+    # replace a model; requests already using the old one keep it
+    def replace(self, key, model):
+        if key in self._models:
+            self._models[key] = model
+
+    # reload every model whose file changed since it was loaded
+    async def reload_changed(self, loop):
+        for key, (file_path, signature) in list(self.files.items()):
+            if key not in self._models:
+                # evicted (or still loading); it is loaded again on its next use
+                continue
+            try:
+                new_signature = file_signature(file_path)
+            except OSError:
+                # the file is gone; keep serving the model
+                continue
+            if new_signature == signature:
+                continue
+            try:
+                model = await loop.run_in_executor(None, markov.load_markov_model, file_path)
+            except (OSError, ValueError, KeyError, EOFError, zipfile.BadZipFile):
+                continue
+            self.replace(key, model)
+            self.files[key] = (file_path, new_signature)
+            self.reloads += 1
+
+def file_signature(file_path):
+    stat = os.stat(file_path)
+    return (stat.st_size, stat.st_mtime_ns)
+
+# Answers queries in batches: see the top of this file.
+class Coalescer:
+    def __init__(self, models):
+        self.models = models
+        self.executor = ThreadPoolExecutor(1)
+        self.pending = []
+        self.running = False
+        self.batches = 0
+        self.queries = 0
+
+    async def answer(self, query):
+        future = asyncio.get_running_loop().create_future()
+        self.pending.append((query, future))
+        if not self.running:
+            self.running = True
+            asyncio.get_running_loop().create_task(self._drain())
+        return await future
+
+    async def _drain(self):
+        loop = asyncio.get_running_loop()
+        try:
+            while self.pending:
+                # let requests that are already readable join this batch
+                await asyncio.sleep(0)
+                pending, self.pending = self.pending, []
+                queries = [query for query, future in pending]
+                try:
+                    answers = await loop.run_in_executor(self.executor, batch.answer_queries, queries, self.models)
+                except Exception:
+                    # find the query that failed the batch, without failing the others
+                    answers = await loop.run_in_executor(self.executor, answer_separately, queries, self.models)
+                self.batches += 1
+                self.queries += len(queries)
+                for (query, future), answer in zip(pending, answers):
+                    if not future.done():
+                        future.set_result(answer)
+        finally:
+            self.running = False
+
+# answer queries one at a time, so that an error only fails its own query
+def answer_separately(queries, models):
+    answers = []
+    for query in queries:
+        try:
+            answers.extend(batch.answer_queries([query], models))
+        except Exception as error:
+            answers.append(batch.error_answer(query, error))
+    return answers
+
+class ForecastServer:
+    def __init__(self, models=None, reload_seconds=RELOAD_SECONDS):
+        self.models = models or ReloadingModelStore()
+        self.coalescer = Coalescer(self.models)
+        self.reload_seconds = reload_seconds
+
+    async def handle_connection(self, reader, writer):
+        try:
+            while True:
+                try:
+                    request = await read_request(reader)
+                except BadRequest as error:
+                    await write_response(writer, error.status, {"error" : str(error)}, keep_alive=False)
+                    break
+                if request is None:
+                    break
+                method, path, headers, body = request
+                status, answer = await self.route(method, path, body)
+                keep_alive = headers.get("connection", "").lower() != "close"
+                await write_response(writer, status, answer, keep_alive)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            # the client went away or did not speak HTTP
+            pass
+        finally:
+            writer.close()
+
+    async def route(self, method, path, body):
+        if path == "/health":
+            return 200, {"status" : "ok"}
+        if path == "/models":
+            return 200, {
+                "models" : [key[1] if key[0] == "model" else "_".join(key[0]) + f" n_gram={key[1]}" for key in self.models.loaded_keys()],
+                "reloads" : self.models.reloads,
+                "batches" : self.coalescer.batches,
+                "queries" : self.coalescer.queries
+            }
+        if path != "/forecast":
+            return 404, {"error" : f"no such path: {path}"}
+        if method != "POST":
+            return 405, {"error" : "use POST"}
+        try:
+            queries = json.loads(body)
+        except ValueError as error:
+            return 400, batch.error_answer(None, error)
+        if isinstance(queries, list):
+            return 200, list(await asyncio.gather(*[self.coalescer.answer(query) for query in queries]))
+        return 200, await self.coalescer.answer(queries)
+
+    async def reload_forever(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(self.reload_seconds)
+            await self.models.reload_changed(loop)
+
+    async def serve(self, host="127.0.0.1", port=8080, unix_path=None):
+        if unix_path is not None:
+            server = await asyncio.start_unix_server(self.handle_connection, unix_path)
+        else:
+            server = await asyncio.start_server(self.handle_connection, host, port, backlog=1024)
+        reloader = asyncio.get_running_loop().create_task(self.reload_forever())
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            reloader.cancel()
+
+# a request that cannot be answered, with the status to answer it with
+class BadRequest(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+# Read one HTTP request. Returns (method, path, headers, body), or None if
+# the client closed the connection; raises BadRequest if the request cannot
+# be read (its body, if any, is left unread).
+async def read_request(reader):
+    request_line = await reader.readline()
+    if not request_line:
+        return None
+    parts = request_line.decode("latin-1").split()
+    if len(parts) != 3 or not parts[2].startswith("HTTP/"):
+        raise BadRequest(400, f"malformed request line: {request_line[:100]!r}")
+    method, path, version = parts
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+    try:
+        length = int(headers.get("content-length", 0))
+    except ValueError:
+        raise BadRequest(400, f"malformed content-length: {headers['content-length'][:100]!r}")
+    if length < 0:
+        raise BadRequest(400, f"malformed content-length: {length}")
+    if length > MAX_BODY_BYTES:
+        raise BadRequest(413, f"request body of {length} bytes is larger than {MAX_BODY_BYTES}")
+    body = await reader.readexactly(length) if length else b""
+    return method, path.split("?")[0], headers, body
+
+REASONS = {200 : "OK", 400 : "Bad Request", 404 : "Not Found", 405 : "Method Not Allowed", 413 : "Content Too Large"}
+
+async def write_response(writer, status, answer, keep_alive=True):
+    body = json.dumps(answer).encode()
+    head = (f"HTTP/1.1 {status} {REASONS[status]}\r\nContent-Type: application/json\r\n"
+        f"Content-Length: {len(body)}\r\nConnection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n")
+    writer.write(head.encode("latin-1") + body)
+    await writer.drain()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve forecasts over HTTP.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--unix", metavar="PATH", help="listen on a unix socket instead of a TCP port")
+    parser.add_argument("--reload-seconds", type=float, default=RELOAD_SECONDS, help="how often to check model files for changes")
+    args = parser.parse_args()
+    server = ForecastServer(reload_seconds=args.reload_seconds)
+    try:
+        asyncio.run(server.serve(args.host, args.port, args.unix))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,168 @@
+import numpy as np
+import markov
+
+# Monte Carlo simulation of weather sequences drawn from a model.
+#
+# Every column of the transition matrix is turned into an alias table
+# (Walker's alias method), so drawing the next state of any number of
+# trajectories takes two uniform numbers and a couple of array lookups per
+# trajectory, whatever the number of possible next states. Observed columns
+# get one table each; all unobserved columns share a single table built
+# from the generic vector, just like in the transition matrix itself. The
+# tables have one slot per possible next state and are stored one after
+# another in flat arrays (like a CSR matrix), so they take as much memory
+# as the transitions they are built from.
+
+# the alias table of a probability vector over "states": one slot per state
+def build_alias_table(states, probabilities):
+    width = len(states)
+    outcomes = np.asarray(states, dtype=np.int64)
+    thresholds = np.ones(width)
+    aliases = outcomes.copy()
+    if width == 1:
+        return outcomes, thresholds, aliases
+    scaled = (probabilities / probabilities.sum() * width).tolist()
+    small = [i for i in range(width) if scaled[i] < 1]
+    large = [i for i in range(width) if scaled[i] >= 1]
+    # anything left over from rounding keeps its threshold of 1
+    while small and large:
+        i = small.pop()
+        j = large.pop()
+        thresholds[i] = scaled[i]
+        aliases[i] = outcomes[j]
+        scaled[j] -= 1 - scaled[i]
+        (small if scaled[j] < 1 else large).append(j)
+    return outcomes, thresholds, aliases
+
+class TrajectorySampler:
+    def __init__(self, model):
+        self.model = model
+        matrix = model.transition_matrix
+        self.observed_states = matrix.observed_states
+        starts = np.searchsorted(matrix.current_states, self.observed_states)
+        ends = np.append(starts[1:], matrix.nnz)
+        probabilities = matrix.probabilities
+        generic_vector = matrix.generic_vector
+        generic_states = np.flatnonzero(generic_vector)
+        columns = [(matrix.next_states[start:end], probabilities[start:end]) for start, end in zip(starts, ends)]
+        columns.append((generic_states, generic_vector[generic_states]))
+        tables = [build_alias_table(states, probabilities) for states, probabilities in columns]
+        # one table per observed state, followed by the table of the generic vector
+        self.lengths = np.array([len(table[0]) for table in tables], dtype=np.int64)
+        self.offsets = np.append(0, np.cumsum(self.lengths)[:-1])
+        self.outcomes = np.concatenate([table[0] for table in tables])
+        self.thresholds = np.concatenate([table[1] for table in tables])
+        self.aliases = np.concatenate([table[2] for table in tables])
+
+    # bytes used by the alias tables
+    @property
+    def nbytes(self):
+        return sum(array.nbytes for array in (self.lengths, self.offsets, self.outcomes, self.thresholds, self.aliases))
+
+    # draw the next state of every trajectory currently in "states"
+    def step(self, states, rng):
+        positions = np.searchsorted(self.observed_states, states)
+        found = positions < len(self.observed_states)
+        found[found] = self.observed_states[positions[found]] == states[found]
+        rows = np.where(found, positions, len(self.observed_states))
+        lengths = self.lengths[rows]
+        # the minimum guards against u * length rounding up to length
+        slots = self.offsets[rows] + np.minimum((rng.random(len(states)) * lengths).astype(np.int64), lengths - 1)
+        keep = rng.random(len(states)) < self.thresholds[slots]
+        return np.where(keep, self.outcomes[slots], self.aliases[slots])
+
+    # Draw whole trajectories. Returns an array of shape
+    # (num_trajectories, days) holding the state of each step after "start"
+    # (each step covers n_gram days).
+    def sample(self, start, days, num_trajectories, seed=None):
+        rng = np.random.default_rng(seed)
+        states = np.full(num_trajectories, self.model.resolve_states([start])[0])
+        trajectories = np.empty((num_trajectories, days), dtype=np.int64)
+        for day in range(days):
+            states = self.step(states, rng)
+            trajectories[:, day] = states
+        return trajectories
+
+    # Simulate many trajectories of "steps" steps without keeping them, in
+    # batches of batch_size, and summarize them (see SimulationSummary).
+    def simulate(self, start, steps, num_trajectories, seed=None, batch_size=100000):
+        rng = np.random.default_rng(seed)
+        start = self.model.resolve_states([start])[0]
+        summary = SimulationSummary(self.model, steps)
+        for first in range(0, num_trajectories, batch_size):
+            states = np.full(min(batch_size, num_trajectories - first), start)
+            summary.start_batch(len(states))
+            for step in range(steps):
+                states = self.step(states, rng)
+                summary.add_step(step, states)
+            summary.end_batch()
+        return summary
+
+# Aggregate statistics of simulated trajectories, gathered one step at a
+# time. Each step of a model with n_gram > 1 covers n_gram days, all of
+# which are counted, so there are steps * n_gram days in all:
+# - day_state_counts[d, s]: how many trajectories had weather s (a state of
+#   a single day) on day d + 1
+# - rainy_days_histogram[k]: how many trajectories had k days with rain
+# - dry_spell_histogram[k]: how many trajectories had k as their longest
+#   run of days without rain
+# The histograms have a fixed size, so any number of trajectories can be
+# summarized; they are only kept if the model was trained on "prcp".
+class SimulationSummary:
+    def __init__(self, model, steps):
+        self.params = model.params
+        self.n_gram = model.n_gram
+        self.days = steps * model.n_gram
+        self.num_trajectories = 0
+        self.num_day_states = markov.count_states(model.params)
+        self.day_state_counts = np.zeros((self.days, self.num_day_states), dtype=np.int64)
+        self.has_rain = "prcp" in model.params
+        if self.has_rain:
+            # position of the prcp bin in a day's state code
+            self._prcp_stride = markov.count_states(model.params[model.params.index("prcp") + 1:])
+            self.rainy_days_histogram = np.zeros(self.days + 1, dtype=np.int64)
+            self.dry_spell_histogram = np.zeros(self.days + 1, dtype=np.int64)
+
+    def start_batch(self, num_trajectories):
+        self.num_trajectories += num_trajectories
+        self._rainy = np.zeros(num_trajectories, dtype=np.int64)
+        self._dry_run = np.zeros(num_trajectories, dtype=np.int64)
+        self._longest = np.zeros(num_trajectories, dtype=np.int64)
+
+    def add_step(self, step, states):
+        # the days of an n-gram state, oldest (most significant digit) first
+        for i in range(self.n_gram):
+            day_states = states // self.num_day_states ** (self.n_gram - 1 - i) % self.num_day_states
+            self.add_day(step * self.n_gram + i, day_states)
+
+    def add_day(self, day, day_states):
+        self.day_state_counts[day] += np.bincount(day_states, minlength=self.num_day_states)
+        if self.has_rain:
+            rainy = (day_states // self._prcp_stride) % len(markov.PARAM_RANGES["prcp"]) != 0
+            self._rainy += rainy
+            self._dry_run = np.where(rainy, 0, self._dry_run + 1)
+            np.maximum(self._longest, self._dry_run, out=self._longest)
+
+    def end_batch(self):
+        if self.has_rain:
+            self.rainy_days_histogram += np.bincount(self._rainy, minlength=self.days + 1)
+            self.dry_spell_histogram += np.bincount(self._longest, minlength=self.days + 1)
+
+    # estimated probability of each single-day weather state on each day
+    def day_state_probabilities(self):
+        return self.day_state_counts / self.num_trajectories
+
+    def __str__(self):
+        lines = [f"{self.num_trajectories} trajectories of {self.days} days"]
+        if self.has_rain:
+            for name, histogram in [("rainy days", self.rainy_days_histogram), ("longest dry spell", self.dry_spell_histogram)]:
+                lines.append(f"{name}: mean {histogram_mean(histogram):.2f}, "
+                    f"5%-95% {histogram_percentile(histogram, 5)}-{histogram_percentile(histogram, 95)}")
+        return "\n".join(lines)
+
+def histogram_mean(histogram):
+    return (np.arange(len(histogram)) * histogram).sum() / histogram.sum()
+
+# the smallest value with at least "percent" % of the counts at or below it
+def histogram_percentile(histogram, percent):
+    return int(np.searchsorted(np.cumsum(histogram), histogram.sum() * percent / 100))
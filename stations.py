@@ -0,0 +1,135 @@
+import json
+import os
+import numpy as np
+import markov
+
+# A store of models for many weather stations, all trained with the same
+# params and n_gram (so over the same states). The dense transition
+# matrices of all stations are kept in a single .npy file of shape
+# (stations, num_states, num_states) which is memory-mapped when the store
+# is opened, so opening it takes the same time whatever the number of
+# stations and only the matrices a forecast uses are read from disk.
+# A json index next to it lists the stations (in the order of the array),
+# the params, n_gram and bin edges, and the hash of each station's data.
+MATRICES_FILE = "matrices.npy"
+INDEX_FILE = "stations.json"
+
+class StationStore:
+    def __init__(self, directory):
+        self.directory = directory
+        with open(os.path.join(directory, INDEX_FILE)) as f:
+            index = json.load(f)
+        self.params = tuple(index["params"])
+        self.n_gram = index["n_gram"]
+        self.sliding = index["sliding"]
+        for param in self.params:
+            if tuple(index["bin_edges"][param]) != tuple(float(edge) for edge in markov.BIN_EDGES[param]):
+                raise ValueError(f"{directory} was trained with different bin edges for {param}: {index['bin_edges'][param]}")
+        self.stations = index["stations"]
+        self.data_hashes = index["data_hashes"]
+        self.rows = {station : row for row, station in enumerate(self.stations)}
+        self.matrices = np.load(os.path.join(directory, MATRICES_FILE), mmap_mode='r')
+
+    def __len__(self):
+        return len(self.stations)
+
+    def __contains__(self, station):
+        return station in self.rows
+
+    @property
+    def num_states(self):
+        return self.matrices.shape[1]
+
+    def matrix(self, station):
+        return self.matrices[self.rows[station]]
+
+    # state codes of states given in any form markov.resolve_states accepts
+    def resolve_states(self, states):
+        return markov.resolve_states(self.params, self.n_gram, states)
+
+    # Forecast the weather of many stations at once, each from its own
+    # initial state. Returns an array of shape (len(stations), horizon,
+    # num_states). Every day is a single batched np.matmul over all the
+    # stations; when all stations are forecast in order, the memory-mapped
+    # array is used as it is, otherwise only the matrices of the given
+    # stations are read.
+    def forecast(self, stations, initial_states, horizon):
+        rows = np.array([self.rows[station] for station in stations], dtype=np.int64)
+        codes = self.resolve_states(initial_states)
+        if np.array_equal(rows, np.arange(len(self))):
+            matrices = self.matrices
+        else:
+            matrices = self.matrices[rows]
+        vectors = np.zeros((len(rows), self.num_states, 1), dtype=matrices.dtype)
+        vectors[np.arange(len(rows)), codes, 0] = 1
+        forecasts = np.empty((len(rows), horizon, self.num_states))
+        for day in range(horizon):
+            vectors = np.matmul(matrices, vectors)
+            forecasts[:, day] = vectors[:, :, 0]
+        return forecasts
+
+# Write a store from (station, model) pairs, which may come from a
+# generator: models are written into the memory-mapped array one at a time,
+# so only one of them needs to be in memory. Both files are written under
+# temporary names and only replace those of an existing store (the index
+# last) once every model has been checked and written, so a failed write
+# leaves the old store as it was.
+def write_station_store(directory, station_models, num_stations, params, n_gram, sliding=False, dtype=np.float64):
+    params = tuple(params)
+    for param in params:
+        if param not in markov.PARAM_RANGES:
+            raise ValueError(f"unknown param: {param}")
+    if n_gram < 1:
+        raise ValueError(f"n_gram must be at least 1, not {n_gram}")
+    bin_edges = {param : tuple(float(edge) for edge in markov.BIN_EDGES[param]) for param in params}
+    os.makedirs(directory, exist_ok=True)
+    num_states = markov.count_states(params, n_gram)
+    matrices_path = os.path.join(directory, MATRICES_FILE)
+    index_path = os.path.join(directory, INDEX_FILE)
+    temporary_matrices_path = matrices_path + ".tmp"
+    temporary_index_path = index_path + ".tmp"
+    try:
+        matrices = np.lib.format.open_memmap(temporary_matrices_path, mode='w+',
+            dtype=dtype, shape=(num_stations, num_states, num_states))
+        stations = []
+        data_hashes = []
+        for row, (station, model) in enumerate(station_models):
+            if model.params != params or model.n_gram != n_gram or model.sliding != sliding:
+                raise ValueError(f"the model of {station} was trained with {model.params}, n_gram {model.n_gram}, "
+                    f"sliding {model.sliding}, not {params}, n_gram {n_gram}, sliding {sliding}")
+            for param in params:
+                if tuple(float(edge) for edge in model.bin_edges[param]) != bin_edges[param]:
+                    raise ValueError(f"the model of {station} was trained with different bin edges for {param}: {model.bin_edges[param]}")
+            if row >= num_stations:
+                raise ValueError(f"expected {num_stations} stations, got more")
+            matrices[row] = model.transition_matrix.toarray()
+            stations.append(station)
+            data_hashes.append(model.data_hash)
+        if len(stations) != num_stations:
+            raise ValueError(f"expected {num_stations} stations, got {len(stations)}")
+        matrices.flush()
+        del matrices
+        index = {
+            "params" : list(params),
+            "n_gram" : n_gram,
+            "sliding" : sliding,
+            "bin_edges" : {param : list(edges) for param, edges in bin_edges.items()},
+            "stations" : stations,
+            "data_hashes" : data_hashes
+        }
+        with open(temporary_index_path, 'w') as f:
+            json.dump(index, f)
+    except BaseException:
+        for path in (temporary_matrices_path, temporary_index_path):
+            if os.path.exists(path):
+                os.remove(path)
+        raise
+    os.replace(temporary_matrices_path, matrices_path)
+    os.replace(temporary_index_path, index_path)
+    return StationStore(directory)
+
+# Train a model for every station in "station_files" (a dict of station
+# name to csv file) and write them to a store in "directory".
+def build_station_store(directory, station_files, params, n_gram, sliding=False, dtype=np.float64, trainer=markov.train_weather_model):
+    station_models = ((station, trainer(file_path, params, n_gram, sliding=sliding)) for station, file_path in station_files.items())
+    return write_station_store(directory, station_models, len(station_files), params, n_gram, sliding, dtype)
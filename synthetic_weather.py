@@ -0,0 +1,74 @@
+import numpy as np
+
+# Deterministic synthetic weather data in the schema of
+# data/san_jose_weather.csv, for benchmarks and tests that need more rows
+# than the real file has. The same seed always gives the same file.
+#
+# Temperatures follow a yearly cycle plus autocorrelated noise, rain comes
+# in wet and dry spells, and a small fraction of values is left empty, as
+# in the real data. Dates run on from start_date, one day per row.
+
+HEADER = "\ufeffdate,tavg,tmin,tmax,prcp,snow,wdir,wspd,wpgt,pres,tsun"
+
+# fraction of the tavg, tmin, tmax, prcp and wspd values that are left empty
+MISSING_FRACTION = 0.01
+
+# rows are generated and written this many at a time
+CHUNK_ROWS = 1 << 16
+
+# Generate the rows of a synthetic file, CHUNK_ROWS at a time. Yields arrays
+# of (tavg, tmin, tmax, prcp, wspd, pres) values, one row per day, with NaN
+# for missing values.
+def generate_weather_values(num_rows, seed=0):
+    rng = np.random.default_rng(seed)
+    # carried over between chunks: the temperature anomaly and whether the previous day was wet
+    anomaly = 0.0
+    wet = False
+    for first in range(0, num_rows, CHUNK_ROWS):
+        size = min(CHUNK_ROWS, num_rows - first)
+        days = np.arange(first, first + size)
+        noise = rng.normal(0, 1.5, size)
+        anomalies = np.empty(size)
+        for i in range(size):
+            anomaly = 0.8 * anomaly + noise[i]
+            anomalies[i] = anomaly
+        tavg = 15 + 6 * np.sin(2 * np.pi * (days - 105) / 365.25) + anomalies
+        spread = rng.uniform(4, 12, size)
+        tmin = tavg - spread / 2
+        tmax = tavg + spread / 2
+        # wet and dry spells: a wet day is followed by another with probability 0.6, a dry one with 0.1
+        draws = rng.random(size)
+        wet_days = np.empty(size, dtype=bool)
+        for i in range(size):
+            wet = draws[i] < (0.6 if wet else 0.1)
+            wet_days[i] = wet
+        prcp = np.where(wet_days, rng.exponential(5, size), 0)
+        wspd = rng.gamma(3, 2, size)
+        pres = rng.normal(1016, 4, size)
+        values = np.column_stack([tavg, tmin, tmax, prcp, wspd, pres])
+        values[:, :5][rng.random((size, 5)) < MISSING_FRACTION] = np.nan
+        yield values
+
+# the lines of values of a chunk, with empty fields for missing values
+def format_lines(dates, values):
+    columns = [np.datetime_as_string(dates)]
+    for column in values.T:
+        text = np.char.mod("%.1f", column)
+        columns.append(np.where(np.isnan(column), "", text))
+    date, tavg, tmin, tmax, prcp, wspd, pres = columns
+    empty = np.full(len(date), "")
+    table = [date, tavg, tmin, tmax, prcp, empty, empty, wspd, empty, pres, empty]
+    rows = np.char.add(table[0], ",")
+    for column in table[1:-1]:
+        rows = np.char.add(np.char.add(rows, column), ",")
+    return "\n".join(np.char.add(rows, table[-1]).tolist()) + "\n"
+
+# Write a synthetic csv file of num_rows days.
+def generate_weather_csv(file_path, num_rows, seed=0, start_date="2014-01-01"):
+    start = np.datetime64(start_date, "D")
+    with open(file_path, 'w', encoding='utf-8', newline='') as f:
+        f.write(HEADER + "\n")
+        first = 0
+        for values in generate_weather_values(num_rows, seed):
+            f.write(format_lines(start + np.arange(first, first + len(values)), values))
+            first += len(values)
@@ -0,0 +1,22 @@
+import numpy as np
+import backtest
+
+def test_backtest_scores_every_lead():
+    rng = np.random.default_rng(0)
+    day_states = rng.integers(0, 3, 400)
+    results = backtest.backtest_days(day_states, ["tavg"], 1, lead_days=(1, 3))
+    assert [result.lead for result in results] == [1, 3]
+    for result in results:
+        assert result.message is None
+        assert result.num_forecasts > 0
+        assert np.isfinite(result.log_loss)
+
+def test_backtest_without_origins():
+    day_states = np.zeros(10, dtype=np.int64)
+    results = backtest.backtest_days(day_states, ["tavg"], 2, lead_days=(1, 7), num_folds=5)
+    assert [result.lead for result in results] == [1, 7]
+    for result in results:
+        assert result.num_forecasts == 0
+        assert np.isnan(result.log_loss)
+        assert "no forecast origins" in result.message
+    assert "no forecast origins" in backtest.format_results(results)
@@ -0,0 +1,71 @@
+import io
+import json
+import os
+import numpy as np
+import pytest
+import batch
+import cache
+
+DATA_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "data", "san_jose_weather.csv")
+
+@pytest.fixture
+def models(tmp_path):
+    return batch.ModelStore(cache.ModelCache(), pre_built_directory=str(tmp_path), data_file=DATA_FILE)
+
+def test_answers_match_forecast(models):
+    queries = [{"id" : i, "params" : ["tavg", "prcp"], "state" : i, "horizon" : 3, "probabilities" : True} for i in range(4)]
+    answers = batch.answer_queries(queries, models)
+    model = models.get(models.key(queries[0]))
+    forecasts = model.forecast(list(range(4)), 3)
+    for i, answer in enumerate(answers):
+        assert answer["id"] == i
+        assert len(answer["forecast"]) == 3
+        assert np.allclose([day["probabilities"] for day in answer["forecast"]], forecasts[i])
+        assert len(answer["forecast"][0]["states"]) == batch.DEFAULT_TOP
+
+@pytest.mark.parametrize("bad", [
+    {"state" : [1, 2]},
+    {"state" : 1.5},
+    {"state" : 10 ** 6},
+    {"top" : "x"},
+    {"top" : -1},
+    {"probabilities" : "yes"},
+    {"horizon" : 1e9},
+    {"horizon" : batch.MAX_HORIZON + 1},
+    {"horizon" : 0},
+    {"params" : ["nope"]},
+    {"params" : []},
+    {"params" : ["tavg", "tavg"]},
+    {"params" : "tavg_tavg"},
+    {"sliding" : "false"},
+    {"sliding" : 1},
+    {"n_gram" : 0},
+    {"n_gram" : batch.MAX_N_GRAM + 1},
+    {"n_gram" : "2"},
+    {"n_gram" : True},
+    {"params" : ["tavg", "tmin", "tmax", "prcp", "wspd"], "n_gram" : 3, "horizon" : 100},
+])
+def test_bad_query_gets_its_own_error(models, bad):
+    good = {"params" : ["tavg"], "state" : 0, "horizon" : 2}
+    queries = [dict(good, id=0), dict(good, id=1, **bad), dict(good, id=2)]
+    answers = batch.answer_queries(queries, models)
+    assert [answer["id"] for answer in answers] == [0, 1, 2]
+    assert "error" in answers[1]
+    assert "forecast" in answers[0] and "forecast" in answers[2]
+
+def test_run_batch_answers_every_line(models):
+    lines = ['{"id": 0, "params": ["tavg"], "state": 0, "horizon": 1}', 'not json', '[1, 2]',
+        '{"id": 3, "params": ["tavg"], "state": {"tavg": 30}, "horizon": 1, "top": "x"}',
+        '{"id": 4, "params": "tavg", "state": "25 < tavg;", "horizon": 1}']
+    output = io.StringIO()
+    batch.run_batch(io.StringIO("\n".join(lines) + "\n"), output, models)
+    answers = [json.loads(line) for line in output.getvalue().splitlines()]
+    assert len(answers) == 5
+    assert ["error" in answer for answer in answers] == [False, True, True, True, False]
+
+def test_store_keeps_models_within_cache_limits(models):
+    models.model_cache.max_models = 2
+    for params in (["tavg"], ["prcp"], ["wspd"]):
+        query = {"params" : params, "state" : 0, "horizon" : 1}
+        models.get(models.key(query))
+    assert models.loaded_keys() == [(("prcp",), 1, False), (("wspd",), 1, False)]
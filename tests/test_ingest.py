@@ -0,0 +1,69 @@
+import gzip
+import os
+import numpy as np
+import pytest
+import markov
+import ingest
+import parallel
+
+DATA_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "data", "san_jose_weather.csv")
+PARAMS = ["tavg", "tmax", "tmin", "prcp", "wspd"]
+
+def assert_same_matrix(model, reference):
+    for name in ["current_states", "next_states", "probabilities", "generic_vector"]:
+        assert np.array_equal(getattr(model.transition_matrix, name), getattr(reference.transition_matrix, name)), name
+
+@pytest.fixture(scope="module")
+def gzip_file(tmp_path_factory):
+    file_path = tmp_path_factory.mktemp("data") / "weather.csv.gz"
+    with open(DATA_FILE, 'rb') as f:
+        file_path.write_bytes(gzip.compress(f.read()))
+    return str(file_path)
+
+# the San Jose data with empty lines in it, which the parser skips, and a
+# line of spaces, which it reads as a day of missing values
+@pytest.fixture(scope="module")
+def blank_lines_file(tmp_path_factory):
+    file_path = tmp_path_factory.mktemp("data") / "weather.csv"
+    with open(DATA_FILE, 'rb') as f:
+        lines = f.read().split(b"\n")
+    for position, line in [(700, b""), (350, b" \r"), (2, b"\r")]:
+        lines.insert(position, line)
+    file_path.write_bytes(b"\n".join(lines))
+    return str(file_path)
+
+@pytest.mark.parametrize("n_gram", [1, 2, 3])
+@pytest.mark.parametrize("chunk_bytes", [1000, 1 << 24])
+def test_chunked_ingestion_equals_serial_training(n_gram, chunk_bytes):
+    reference = markov.train_weather_model(DATA_FILE, PARAMS, n_gram)
+    stats = ingest.IngestStats()
+    assert_same_matrix(ingest.train_weather_model(DATA_FILE, PARAMS, n_gram, chunk_bytes=chunk_bytes, stats=stats), reference)
+    assert stats.rows == 3287
+
+def test_chunked_ingestion_reads_gzip(gzip_file):
+    reference = markov.train_weather_model(DATA_FILE, PARAMS, 2)
+    assert_same_matrix(ingest.train_weather_model(gzip_file, PARAMS, 2, chunk_bytes=777), reference)
+
+@pytest.mark.parametrize("n_gram, sliding", [(1, False), (2, False), (3, False), (2, True)])
+@pytest.mark.parametrize("shards", [1, 3, 7])
+def test_parallel_training_equals_serial_training(n_gram, sliding, shards):
+    reference = markov.train_weather_model(DATA_FILE, PARAMS, n_gram, sliding)
+    model = parallel.train_weather_model(DATA_FILE, PARAMS, n_gram, sliding, workers=2, shards_per_file=shards)
+    assert_same_matrix(model, reference)
+    assert model.data_hash == reference.data_hash
+
+def test_parallel_training_adds_up_files(gzip_file, blank_lines_file):
+    files = [DATA_FILE, gzip_file, blank_lines_file]
+    model = parallel.train_weather_model(files, PARAMS, 2, workers=2, shards_per_file=5)
+    reference_pairs = [ingest.count_chunks(ingest.classify_chunks(ingest.read_weather_chunks(file_path, PARAMS), PARAMS), PARAMS, 2)
+        for file_path in files]
+    num_states = markov.count_states(PARAMS, 2)
+    pairs = markov.merge_transition_pairs(reference_pairs, num_states)
+    reference = markov.WeatherModel(PARAMS, 2, markov.sparse_transition_matrix_from_pairs(pairs, num_states))
+    assert_same_matrix(model, reference)
+
+def test_count_days_skips_empty_lines(tmp_path):
+    file_path = tmp_path / "lines.csv"
+    data = b"\n\na,1\n\nb,2\r\n\r\n \n\t\r\nc,3"
+    file_path.write_bytes(data)
+    assert parallel.count_days(str(file_path), 0, len(data)) == len(markov.parse_weather_lines(data, [1])) == 5
@@ -0,0 +1,147 @@
+import os
+import numpy as np
+import pytest
+import markov
+
+DATA_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "data", "san_jose_weather.csv")
+
+@pytest.fixture(scope="module")
+def bigram_model():
+    return markov.train_weather_model(DATA_FILE, ["tavg", "prcp"], 2)
+
+def test_resolve_states_accepts_every_form(bigram_model):
+    days = [{"tavg" : 20, "prcp" : 0}, {"tavg" : 10, "prcp" : 0}]
+    code = markov.encode_observations(days, ["tavg", "prcp"])
+    label = markov.decode_state(code, ["tavg", "prcp"], 2)
+    assert bigram_model.resolve_states([days, label, code, np.int64(code)]).tolist() == [code] * 4
+
+@pytest.mark.parametrize("state", [
+    {"tavg" : 20, "prcp" : 0},   # one day for a 2-day state
+    [{"tavg" : 20}],             # too few days
+    [1, 2],                      # not observations
+    144,                         # past the last state
+    -1,
+    1.7,                         # not an integer code
+    2.0,
+    True,
+    None
+])
+def test_resolve_states_rejects_bad_states(bigram_model, state):
+    with pytest.raises(ValueError):
+        bigram_model.resolve_states([state])
+
+@pytest.mark.parametrize("params, n_gram, sliding", [
+    (["tavg", "tmax"], 1, False),
+    (["tavg", "tmax", "tmin", "prcp", "wspd"], 2, False),
+    (["prcp"], 2, True)
+])
+def test_incremental_model_equals_full_retrain(params, n_gram, sliding):
+    values = markov.load_weather_columns(DATA_FILE, params)
+    incremental = markov.IncrementalMarkovModel(params, n_gram, sliding)
+    incremental.add_values(values[:1000])
+    for row in values[1000:1050]:
+        incremental.add_values(row[np.newaxis])
+    incremental.add_values(values[1050:])
+    full = markov.train_weather_model(DATA_FILE, params, n_gram, sliding)
+    for name in ["current_states", "next_states", "probabilities", "generic_vector"]:
+        assert np.array_equal(getattr(incremental.transition_matrix, name), getattr(full.transition_matrix, name)), name
+    markov_model, generic_model = markov.make_markov_model(DATA_FILE, params, n_gram, batch=True, sliding=sliding)
+    assert incremental.markov_model == markov_model
+    assert incremental.generic_probabilities == pytest.approx(generic_model)
+
+@pytest.mark.parametrize("tolerance", [markov.COMPACT_TOLERANCE, 0])
+def test_compact_matrix_equals_sparse(tolerance):
+    sparse = markov.train_weather_model(DATA_FILE, ["tavg", "tmax", "prcp"], 2).transition_matrix
+    compact = markov.train_weather_model(DATA_FILE, ["tavg", "tmax", "prcp"], 2, compact=True, tolerance=tolerance).transition_matrix
+    atol = markov.FLOAT32_ERROR * 4 if tolerance else 1e-14
+    vectors = np.random.default_rng(0).random((sparse.shape[0], 5))
+    before = compact.nbytes
+    assert np.allclose(compact.dot(vectors), sparse.dot(vectors), rtol=0, atol=atol * vectors.sum())
+    assert np.allclose(compact.dot(vectors[:, 0]), sparse.dot(vectors[:, 0]), rtol=0, atol=atol * vectors.sum())
+    # the probabilities are kept after the first product, and reported
+    assert compact.nbytes > before
+    assert "entry_probabilities" in compact.memory_report()
+    assert np.allclose(compact.toarray(), sparse.toarray(), rtol=0, atol=atol)
+
+def test_state_codes_follow_the_states_vector():
+    params = ["tavg", "prcp", "wspd"]
+    template = markov.construct_states_vector_template(params, 2)
+    assert len(template) == markov.count_states(params, 2)
+    for state in [0, 1, 17, len(template) - 1]:
+        assert markov.decode_state(state, params, 2) == template[state]
+        assert markov.encode_state_label(template[state], params, 2) == state
+
+# two dicts of probabilities have the same keys and (up to rounding) values
+def assert_same_probabilities(expected, actual):
+    assert expected.keys() == actual.keys()
+    assert np.allclose(list(expected.values()), [actual[key] for key in expected], rtol=1e-12, atol=0)
+
+# two (markov_model, generic_probabilities) pairs, as make_markov_model returns them, are the same
+def assert_same_dict_models(expected, actual):
+    (expected_model, expected_generic), (actual_model, actual_generic) = expected, actual
+    assert expected_model.keys() == actual_model.keys()
+    for state in expected_model:
+        assert_same_probabilities(expected_model[state], actual_model[state])
+    assert_same_probabilities(expected_generic, actual_generic)
+
+@pytest.mark.parametrize("params, n_gram", [(["tavg"], 1), (["tavg", "prcp"], 2), (["tmin", "tmax", "wspd"], 1), (["tavg", "prcp", "wspd"], 3)])
+def test_batch_model_equals_dict_model(params, n_gram):
+    dict_models = markov.make_markov_model(DATA_FILE, params, n_gram)
+    assert_same_dict_models(dict_models, markov.make_markov_model(DATA_FILE, params, n_gram, batch=True))
+    # the sparse matrix trained from the same pairs is the dense matrix of the dict model
+    num_states = markov.count_states(params, n_gram)
+    if num_states > markov.DENSE_STATE_LIMIT:
+        return
+    dense = markov.construct_transition_matrix(dict_models[0], num_states, markov.construct_generic_probability_vector(dict_models[1], num_states))
+    sparse = markov.train_weather_model(DATA_FILE, params, n_gram).transition_matrix
+    assert np.allclose(sparse.toarray(), dense, rtol=0, atol=1e-12)
+
+@pytest.mark.parametrize("days", [0, 1, 5, np.int64(13), 64])
+def test_long_horizon_forecasters_match_steps(bigram_model, days):
+    vec = np.zeros(bigram_model.num_states)
+    vec[[3, 40]] = 0.5
+    steps = bigram_model.forecast_distribution(vec, days, method="steps")
+    assert np.allclose(bigram_model.forecast_distribution(vec, days, method="power"), steps, rtol=0, atol=1e-12)
+    assert np.allclose(bigram_model.forecast_distribution(vec, days, method="eigen"), steps, rtol=0, atol=1e-9)
+    assert np.allclose(bigram_model.matrix_power(days) @ vec, steps, rtol=0, atol=1e-12)
+
+def test_stationary_distribution_is_the_limit_of_steps(bigram_model):
+    stationary = bigram_model.stationary_distribution()
+    assert np.isclose(stationary.sum(), 1)
+    assert np.allclose(bigram_model.forecast_distribution(stationary, 1, method="steps"), stationary, rtol=0, atol=1e-10)
+    vec = np.zeros(bigram_model.num_states)
+    vec[0] = 1
+    assert np.allclose(bigram_model.forecast_distribution(vec, 2000, method="steps"), stationary, rtol=0, atol=1e-6)
+
+@pytest.mark.parametrize("days", [-1, 2.5, "3"])
+def test_forecasters_reject_bad_days(bigram_model, days):
+    vec = np.ones(bigram_model.num_states) / bigram_model.num_states
+    with pytest.raises((ValueError, TypeError)):
+        bigram_model.forecast_distribution(vec, days)
+    with pytest.raises((ValueError, TypeError)):
+        bigram_model.matrix_power(days)
+
+@pytest.mark.parametrize("params, n_gram", [(["tmin", "tmax", "wspd"], 1), (["tavg", "prcp"], 2), (["tavg", "prcp", "wspd"], 3)])
+def test_sliding_windows_count_every_transition(params, n_gram):
+    dict_models = markov.make_markov_model(DATA_FILE, params, n_gram, sliding=True)
+    assert_same_dict_models(dict_models, markov.make_markov_model(DATA_FILE, params, n_gram, batch=True, sliding=True))
+    # every window of 2 * n_gram consecutive days, counted directly
+    day_states = markov.classify_weather_columns(markov.load_weather_columns(DATA_FILE, params), params).tolist()
+    num_day_states = markov.count_states(params)
+    counts = {}
+    for first in range(len(day_states) - 2 * n_gram + 1):
+        current_state = next_state = 0
+        for day in range(n_gram):
+            current_state = current_state * num_day_states + day_states[first + day]
+            next_state = next_state * num_day_states + day_states[first + n_gram + day]
+        futures = counts.setdefault(current_state, {})
+        futures[next_state] = futures.get(next_state, 0) + 1
+    expected = {state : {future : count / sum(futures.values()) for future, count in futures.items()} for state, futures in counts.items()}
+    assert dict_models[0].keys() == expected.keys()
+    for state in expected:
+        assert_same_probabilities(expected[state], dict_models[0][state])
+    # overlapping windows give about 2 * n_gram + 1 times as many transitions as blocks
+    sliding_total = sum(sum(futures.values()) for futures in counts.values())
+    block_total = len(markov.find_transitions(np.array(day_states[1:]), num_day_states, n_gram)[0])
+    assert sliding_total == len(day_states) - 2 * n_gram + 1
+    assert sliding_total > 2 * n_gram * block_total
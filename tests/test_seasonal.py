@@ -0,0 +1,34 @@
+import os
+import numpy as np
+import pytest
+import markov
+import seasonal
+
+DATA_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "data", "san_jose_weather.csv")
+PARAMS = ["tavg", "prcp"]
+
+@pytest.mark.parametrize("n_gram, sliding", [(1, False), (2, False), (2, True)])
+def test_season_matrix_equals_model_of_its_transitions(n_gram, sliding):
+    model = seasonal.train_seasonal_model(DATA_FILE, PARAMS, n_gram, sliding=sliding)
+    assert model.num_seasons == 12
+    day_states = markov.classify_weather_columns(markov.load_weather_columns(DATA_FILE, PARAMS), PARAMS)
+    dates = seasonal.load_weather_dates(DATA_FILE)
+    current_states, next_states = markov.find_transitions(day_states if sliding else day_states[1:],
+        markov.count_states(PARAMS), n_gram, sliding)
+    days = seasonal.transition_days(len(day_states), n_gram, sliding)
+    july = dates[days].astype("datetime64[M]").astype(np.int64) % 12 == 6
+    num_states = markov.count_states(PARAMS, n_gram)
+    pairs = markov.make_transition_pairs(current_states[july], next_states[july], num_states)
+    reference = markov.sparse_transition_matrix_from_pairs(pairs, num_states)
+    assert np.allclose(model.matrix_for("2030-07-15").toarray(), reference.toarray())
+
+# every step of a model with n_gram days per state moves n_gram days on
+def test_forecast_steps_by_n_gram_days():
+    model = seasonal.train_seasonal_model(DATA_FILE, PARAMS, 2)
+    forecast = model.forecast([3], 40, "2024-06-20")[0]
+    vec = np.zeros(model.num_states)
+    vec[3] = 1
+    for step in range(40):
+        vec = model.matrix_for(np.datetime64("2024-06-21") + 2 * step).toarray() @ vec
+    assert np.allclose(forecast[-1], vec)
+    assert np.allclose(model.forecast_distribution(np.eye(model.num_states)[3], 40, start_date="2024-06-20"), vec)
@@ -0,0 +1,77 @@
+import asyncio
+import json
+import os
+import batch
+import cache
+import markov
+import server
+
+DATA_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "data", "san_jose_weather.csv")
+
+def make_server(tmp_path):
+    models = server.ReloadingModelStore(cache.ModelCache(), pre_built_directory=str(tmp_path), data_file=DATA_FILE)
+    return server.ForecastServer(models)
+
+# post each body concurrently, so that their queries are coalesced into one batch
+def post_all(forecast_server, bodies):
+    async def post():
+        return await asyncio.gather(*[forecast_server.route("POST", "/forecast", json.dumps(body)) for body in bodies])
+    return asyncio.run(post())
+
+GOOD = {"params" : ["tavg"], "state" : 0, "horizon" : 2}
+
+def test_bad_queries_get_their_own_errors(tmp_path):
+    forecast_server = make_server(tmp_path)
+    bodies = [dict(GOOD, id=0), dict(GOOD, id=1, top="x"), dict(GOOD, id=2), dict(GOOD, id=3, horizon=10 ** 9),
+        [dict(GOOD, id=4), dict(GOOD, id=5, state=[1, 2])]]
+    responses = post_all(forecast_server, bodies)
+    assert all(status == 200 for status, answer in responses)
+    answers = [answer for status, answer in responses[:4]] + responses[4][1]
+    assert [answer["id"] for answer in answers] == [0, 1, 2, 3, 4, 5]
+    assert ["error" in answer for answer in answers] == [False, True, False, True, False, True]
+    assert forecast_server.coalescer.batches == 1
+
+def test_failed_batch_is_answered_query_by_query(tmp_path, monkeypatch):
+    forecast_server = make_server(tmp_path)
+    answer_queries = batch.answer_queries
+    # a batch.answer_queries that raises on any batch holding the query with id "bad"
+    def failing_answer_queries(queries, models):
+        if any(query.get("id") == "bad" for query in queries):
+            raise RuntimeError("bad query")
+        return answer_queries(queries, models)
+    monkeypatch.setattr(batch, "answer_queries", failing_answer_queries)
+    responses = post_all(forecast_server, [dict(GOOD, id=0), dict(GOOD, id="bad"), dict(GOOD, id=2)])
+    answers = [answer for status, answer in responses]
+    assert "forecast" in answers[0] and "forecast" in answers[2]
+    assert answers[1] == {"id" : "bad", "error" : "RuntimeError: bad query"}
+
+def test_models_are_only_loaded_by_registry_name(tmp_path):
+    model = markov.train_weather_model(DATA_FILE, ["tavg"], 1)
+    markov.save_markov_model(model, str(tmp_path / "tavg.npz"))
+    forecast_server = make_server(tmp_path)
+    bodies = [{"id" : 0, "model" : "tavg", "state" : 0, "horizon" : 1}, {"id" : 1, "model" : "/etc/passwd", "state" : 0, "horizon" : 1},
+        {"id" : 2, "model" : str(tmp_path / "tavg.npz"), "state" : 0, "horizon" : 1}]
+    answers = [answer for status, answer in post_all(forecast_server, bodies)]
+    assert "forecast" in answers[0]
+    assert answers[1]["error"].startswith("KeyError") and answers[2]["error"].startswith("KeyError")
+
+# send raw bytes to a running server and return the status of its answer
+def send_raw(forecast_server, request):
+    async def send():
+        server = await asyncio.start_server(forecast_server.handle_connection, "127.0.0.1", 0)
+        async with server:
+            reader, writer = await asyncio.open_connection(*server.sockets[0].getsockname()[:2])
+            writer.write(request)
+            await writer.drain()
+            status_line = await reader.readline()
+            writer.close()
+            return int(status_line.split()[1])
+    return asyncio.run(send())
+
+def test_bad_http_requests_are_answered(tmp_path):
+    forecast_server = make_server(tmp_path)
+    assert send_raw(forecast_server, b"GET /health HTTP/1.1\r\n\r\n") == 200
+    assert send_raw(forecast_server, b"nonsense\r\n\r\n") == 400
+    assert send_raw(forecast_server, b"POST /forecast HTTP/1.1\r\nContent-Length: x\r\n\r\n") == 400
+    too_large = f"POST /forecast HTTP/1.1\r\nContent-Length: {server.MAX_BODY_BYTES + 1}\r\n\r\n".encode()
+    assert send_raw(forecast_server, too_large) == 413
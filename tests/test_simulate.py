@@ -0,0 +1,34 @@
+import os
+import numpy as np
+import pytest
+import markov
+import simulate
+
+DATA_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "data", "san_jose_weather.csv")
+PARAMS = ["tavg", "prcp"]
+
+@pytest.mark.parametrize("n_gram", [1, 2])
+def test_simulated_days_match_forecast(n_gram):
+    model = markov.train_weather_model(DATA_FILE, PARAMS, n_gram)
+    steps = 6
+    summary = simulate.TrajectorySampler(model).simulate(0, steps, 40000, seed=0, batch_size=15000)
+    assert summary.days == steps * n_gram
+    # the probability of each single-day state on each day, from the exact forecast
+    num_day_states = markov.count_states(PARAMS)
+    forecast = model.forecast([0], steps)[0].reshape((steps,) + (num_day_states,) * n_gram)
+    exact = np.stack([forecast.sum(axis=tuple(axis for axis in range(1, n_gram + 1) if axis != i + 1))
+        for i in range(n_gram)], axis=1).reshape(steps * n_gram, num_day_states)
+    assert np.abs(summary.day_state_probabilities() - exact).max() < 0.02
+    assert summary.rainy_days_histogram.sum() == summary.dry_spell_histogram.sum() == 40000
+    assert len(summary.rainy_days_histogram) == summary.days + 1
+
+def test_alias_tables_hold_one_slot_per_transition():
+    model = markov.train_weather_model(DATA_FILE, ["tavg", "tmin", "prcp", "wspd"], 2, sliding=True)
+    sampler = simulate.TrajectorySampler(model)
+    matrix = model.transition_matrix
+    assert len(sampler.outcomes) == matrix.nnz + np.count_nonzero(matrix.generic_vector)
+    # one step from an observed state follows its column
+    state = int(np.argmax(np.bincount(matrix.current_states)))
+    draws = sampler.step(np.full(200000, state), np.random.default_rng(0))
+    frequencies = np.bincount(draws, minlength=model.num_states) / len(draws)
+    assert np.abs(frequencies - matrix.column(state)).max() < 0.01
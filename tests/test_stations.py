@@ -0,0 +1,36 @@
+import os
+import numpy as np
+import pytest
+import markov
+import stations
+
+DATA_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "data", "san_jose_weather.csv")
+PARAMS = ["tavg", "prcp"]
+
+def test_store_forecasts_like_each_model(tmp_path):
+    # a second station with different transitions: only the first 1000 days
+    partial = markov.IncrementalMarkovModel(PARAMS, 1)
+    partial.add_values(markov.load_weather_columns(DATA_FILE, PARAMS)[:1000])
+    models = {"a" : markov.train_weather_model(DATA_FILE, PARAMS, 1), "b" : partial}
+    store = stations.write_station_store(str(tmp_path), models.items(), 2, PARAMS, 1)
+    forecasts = store.forecast(["b", "a"], [{"tavg" : 20, "prcp" : 0}, 3], 4)
+    assert np.allclose(forecasts[0], models["b"].forecast([{"tavg" : 20, "prcp" : 0}], 4)[0])
+    assert np.allclose(forecasts[1], models["a"].forecast([3], 4)[0])
+    with pytest.raises(ValueError):
+        store.forecast(["a"], [store.num_states], 1)
+
+@pytest.mark.parametrize("n_gram, sliding", [(2, False), (1, True)])
+def test_store_rejects_models_trained_differently(tmp_path, n_gram, sliding):
+    model = markov.train_weather_model(DATA_FILE, PARAMS, n_gram, sliding)
+    with pytest.raises(ValueError):
+        stations.write_station_store(str(tmp_path), [("a", model)], 1, PARAMS, 1)
+
+def test_rejected_rewrite_keeps_the_old_store(tmp_path):
+    models = {"a" : markov.train_weather_model(DATA_FILE, PARAMS, 1), "b" : markov.train_weather_model(DATA_FILE, PARAMS, 1, sliding=True)}
+    stations.write_station_store(str(tmp_path), [("a", models["a"]), ("b", models["a"])], 2, PARAMS, 1)
+    with pytest.raises(ValueError):
+        stations.write_station_store(str(tmp_path), [("c", models["a"]), ("d", models["b"])], 2, PARAMS, 1)
+    store = stations.StationStore(str(tmp_path))
+    assert store.stations == ["a", "b"]
+    assert np.array_equal(store.matrix("b"), models["a"].transition_matrix.toarray())
+    assert sorted(os.listdir(tmp_path)) == [stations.MATRICES_FILE, stations.INDEX_FILE]
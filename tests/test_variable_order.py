@@ -0,0 +1,26 @@
+import os
+import numpy as np
+import pytest
+import variable_order
+
+DATA_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "data", "san_jose_weather.csv")
+PARAMS = ["tavg", "prcp"]
+
+# with only the empty context every day is forecast with the generic distribution
+@pytest.mark.parametrize("max_order, min_count", [(0, 1), (3, 10 ** 9)])
+def test_model_with_only_the_root(max_order, min_count):
+    model = variable_order.train_variable_order_model(DATA_FILE, PARAMS, max_order, min_count)
+    assert model.num_contexts == 1
+    assert model.lookup([1, 2, 3]) == 0
+    generic = model.next_day_distribution([])
+    assert generic.sum() == pytest.approx(1)
+    forecasts = model.forecast([[1, 2], [3]], 4)
+    assert forecasts.shape == (2, 4, len(generic))
+    assert np.allclose(forecasts, generic)
+
+def test_longer_contexts_back_off():
+    model = variable_order.train_variable_order_model(DATA_FILE, PARAMS, 3)
+    assert model.num_contexts > 1
+    node = model.lookup([0, 0, 0])
+    assert 0 < len(model.context(node)) <= 3
+    assert model.forecast([[0, 0, 0]], 5).sum(axis=2) == pytest.approx(1)
@@ -0,0 +1,201 @@
+import numpy as np
+import markov
+
+# A variable-order Markov model. Instead of a fixed n_gram, whose number of
+# states grows as |states|^n, the model keeps only the contexts (runs of
+# preceding days) that were actually observed, up to max_order days long.
+# A forecast uses the longest observed context that matches the recent
+# days, backing off to shorter ones (down to the empty context, which is
+# the generic distribution) when a longer one was never seen.
+#
+# Contexts are stored in a trie read from the most recent day backwards:
+# the children of a context are the contexts one day longer into the past.
+# Nodes are numbered in breadth-first order (so by length) and the trie is
+# kept in flat arrays:
+# - node_parent[i], node_day[i], node_depth[i]: the parent of node i, the
+#   day (single-day state) it adds to its parent's context, and its length
+# - child_keys, child_ids: for every node but the root, the key
+#   parent * num_states + day, sorted, and the node it leads to
+# - counts_ptr, next_days, next_counts: how often each day followed each
+#   context, in compressed sparse row form
+# so memory grows with the number of distinct observed contexts.
+class VariableOrderModel:
+    def __init__(self, params, max_order, node_parent, node_day, node_depth, next_nodes, next_days, next_counts):
+        self.params = tuple(params)
+        self.max_order = max_order
+        self.num_states = markov.count_states(params)
+        self.node_parent = node_parent
+        self.node_day = node_day
+        self.node_depth = node_depth
+        child_keys = node_parent[1:] * self.num_states + node_day[1:]
+        order = np.argsort(child_keys)
+        self.child_keys = child_keys[order]
+        self.child_ids = (order + 1).astype(np.int64)
+        self.counts_ptr = np.searchsorted(next_nodes, np.arange(len(node_parent) + 1))
+        self.next_days = next_days
+        self.next_counts = next_counts
+        totals = np.add.reduceat(next_counts, self.counts_ptr[:-1])
+        self.next_probabilities = next_counts / np.repeat(totals, np.diff(self.counts_ptr))
+        # entries grouped by next day, so that next_day_distributions can sum them with np.add.reduceat
+        self._day_order = np.argsort(next_days, kind="stable")
+        self._day_entry_nodes = next_nodes[self._day_order]
+        self._days, self._day_starts = np.unique(next_days[self._day_order], return_index=True)
+        self._node_matrix = None
+
+    @property
+    def num_contexts(self):
+        return len(self.node_parent)
+
+    @property
+    def nbytes(self):
+        arrays = [self.node_parent, self.node_day, self.node_depth, self.child_keys, self.child_ids,
+            self.counts_ptr, self.next_days, self.next_counts, self.next_probabilities]
+        return sum(array.nbytes for array in arrays)
+
+    # the child of each of "nodes" for each of "days" (or -1 if there is none)
+    def children(self, nodes, days):
+        keys = np.asarray(nodes) * self.num_states + np.asarray(days)
+        if not len(self.child_keys):
+            # only the root
+            return np.full(keys.shape, -1, dtype=np.int64)
+        positions = np.minimum(np.searchsorted(self.child_keys, keys), len(self.child_keys) - 1)
+        return np.where(self.child_keys[positions] == keys, self.child_ids[positions], -1)
+
+    # the node of the longest observed context matching the end of "history"
+    # (day states, oldest first), found in at most max_order steps
+    def lookup(self, history):
+        node = 0
+        for day in reversed(list(history)[-self.max_order:] if self.max_order else []):
+            child = int(self.children(node, day))
+            if child < 0:
+                break
+            node = child
+        return node
+
+    # the days of a node's context, oldest first
+    def context(self, node):
+        days = []
+        while node > 0:
+            days.append(int(self.node_day[node]))
+            node = self.node_parent[node]
+        return days[::-1]
+
+    # probabilities of every single-day state on the day after "history"
+    def next_day_distribution(self, history):
+        node = self.lookup(self.resolve_history(history))
+        start, end = self.counts_ptr[node], self.counts_ptr[node + 1]
+        vec = np.zeros(self.num_states)
+        vec[self.next_days[start:end]] = self.next_probabilities[start:end]
+        return vec
+
+    # days given as state codes, descriptions or raw observations (dicts)
+    def resolve_history(self, history):
+        days = []
+        for day in history:
+            if isinstance(day, str):
+                days.append(markov.encode_state_label(day, self.params))
+            elif isinstance(day, dict):
+                days.append(markov.encode_observations([day], self.params))
+            else:
+                days.append(int(day))
+        return days
+
+    # The model as a Markov chain over its contexts: after day d follows
+    # context c, the new context is the longest observed suffix of c + d.
+    # Since every suffix of an observed context was observed too, this is the
+    # same context the full history would back off to, so propagating a
+    # distribution over contexts is exact.
+    def node_transition_matrix(self):
+        if self._node_matrix is None:
+            nodes = np.repeat(np.arange(self.num_contexts), np.diff(self.counts_ptr))
+            targets = np.zeros(len(nodes), dtype=np.int64)
+            # whether the target used all of the node's context
+            complete = np.zeros(len(nodes), dtype=bool)
+            entry_keys = nodes * self.num_states + self.next_days
+            for depth in range(self.node_depth.max() + 1):
+                entries = np.flatnonzero(self.node_depth[nodes] == depth)
+                if depth == 0:
+                    found = self.children(np.zeros(len(entries), dtype=np.int64), self.next_days[entries])
+                    targets[entries] = np.maximum(found, 0)
+                    complete[entries] = found >= 0
+                    continue
+                # extend the target of (parent context, same day) by this node's day
+                parent_entries = np.searchsorted(entry_keys, self.node_parent[nodes[entries]] * self.num_states + self.next_days[entries])
+                parent_targets = targets[parent_entries]
+                extend = complete[parent_entries] & (depth < self.max_order)
+                found = np.where(extend, self.children(parent_targets, self.node_day[nodes[entries]]), -1)
+                targets[entries] = np.where(found >= 0, found, parent_targets)
+                complete[entries] = found >= 0
+            pairs, inverse = np.unique(nodes * self.num_contexts + targets, return_inverse=True)
+            probabilities = np.bincount(inverse, weights=self.next_probabilities, minlength=len(pairs))
+            current_nodes, next_nodes = np.divmod(pairs, self.num_contexts)
+            self._node_matrix = markov.SparseTransitionMatrix(self.num_contexts, current_nodes, next_nodes,
+                probabilities, np.zeros(self.num_contexts))
+        return self._node_matrix
+
+    # probabilities of every single-day state on the next day, for each
+    # column of "vectors" (distributions over contexts)
+    def next_day_distributions(self, vectors):
+        weights = self.next_probabilities[self._day_order].reshape((-1,) + (1,) * (vectors.ndim - 1))
+        result = np.zeros((self.num_states,) + vectors.shape[1:])
+        result[self._days] = np.add.reduceat(weights * vectors[self._day_entry_nodes], self._day_starts, axis=0)
+        return result
+
+    # Forecast many histories at once. Returns an array of shape
+    # (len(histories), horizon, num_states) with the probabilities of every
+    # single-day state on each of the "horizon" days after each history.
+    def forecast(self, histories, horizon):
+        node_matrix = self.node_transition_matrix()
+        starts = [self.lookup(self.resolve_history(history)) for history in histories]
+        vectors = np.zeros((self.num_contexts, len(starts)))
+        vectors[starts, np.arange(len(starts))] = 1
+        forecasts = np.empty((len(starts), horizon, self.num_states))
+        for day in range(horizon):
+            forecasts[:, day] = self.next_day_distributions(vectors).T
+            vectors = node_matrix.dot(vectors)
+        return forecasts
+
+# Build the context trie of a sequence of day states. Every day is predicted
+# from each of the contexts of up to max_order days before it; contexts seen
+# fewer than min_count times are left out (and so backed off from).
+def build_variable_order_model(day_states, params, max_order, min_count=1):
+    num_states = markov.count_states(params)
+    day_states = np.asarray(day_states, dtype=np.int64)
+    positions = np.arange(len(day_states))
+    # the node of the context of each length k before each day, for the current k
+    node_of = np.zeros(len(day_states), dtype=np.int64)
+    valid = np.ones(len(day_states), dtype=bool)
+    node_parent = [np.array([-1])]
+    node_day = [np.array([-1])]
+    node_depth = [np.array([0])]
+    observed_nodes = [node_of.copy()]
+    observed_days = [day_states]
+    num_nodes = 1
+    for k in range(1, max_order + 1):
+        valid &= positions >= k
+        indices = np.flatnonzero(valid)
+        if not len(indices):
+            break
+        keys = node_of[indices] * num_states + day_states[indices - k]
+        unique_keys, inverse, counts = np.unique(keys, return_inverse=True, return_counts=True)
+        kept = counts >= min_count
+        new_ids = np.full(len(unique_keys), -1, dtype=np.int64)
+        new_ids[kept] = num_nodes + np.arange(kept.sum())
+        num_nodes += int(kept.sum())
+        parents, days = np.divmod(unique_keys[kept], num_states)
+        node_parent.append(parents)
+        node_day.append(days)
+        node_depth.append(np.full(len(parents), k))
+        nodes = new_ids[inverse]
+        valid[indices[nodes < 0]] = False
+        node_of[indices] = nodes
+        observed_nodes.append(nodes[nodes >= 0])
+        observed_days.append(day_states[indices[nodes >= 0]])
+    next_nodes, next_days, next_counts = markov.make_transition_pairs(
+        np.concatenate(observed_nodes), np.concatenate(observed_days), num_states)
+    return VariableOrderModel(params, max_order, np.concatenate(node_parent), np.concatenate(node_day),
+        np.concatenate(node_depth), next_nodes, next_days, next_counts)
+
+def train_variable_order_model(file_path, params, max_order, min_count=1):
+    day_states = markov.classify_weather_columns(markov.load_weather_columns(file_path, params), params)
+    return build_variable_order_model(day_states, params, max_order, min_count)